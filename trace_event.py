@@ -34,6 +34,11 @@ trace_event as a dependancy, trace_event is split into an import shim
 shim, trace_event.py, directly into your including codebase. If the
 trace_event_impl is not found, the shim will simply noop.
 
+Importing the shim costs next to nothing: trace_event_impl is only imported
+by trace_enable, and its modules and patches of multiprocessing and
+subprocess only once they are needed. Functions decorated with @traced before
+that pay a single check per call. See trace_event_impl/import_benchmark.py.
+
 trace_event is safe with regard to Python threads. Simply trace as you normally would and each
 thread's timing will show up in the trace file.
 
@@ -43,11 +48,20 @@ logfile. Use of the multiprocessing module will work as well. In both cases,
 however, note that disabling tracing in the parent process will not stop tracing
 in the child processes.
 """
+import os
+import sys
+import time
+
+# trace_event_impl is only imported by trace_enable, so that programs that
+# never trace do not pay for importing it. Until then, or if it is missing,
+# the functions below do nothing.
+
+def _impl():
+  """Returns trace_event_impl if anyone imported it yet, or None."""
+  return sys.modules.get("trace_event_impl")
 
-try:
-  import trace_event_impl
-except ImportError:
-  trace_event_impl = None
+class TraceException(Exception):
+  pass
 
 def trace_can_enable():
   """
@@ -55,76 +69,150 @@ def trace_can_enable():
   trace_enable will fail. Regular tracing methods, including
   trace_begin and trace_end, will simply be no-ops.
   """
-  return trace_event_impl != None
-
-if trace_event_impl:
-  import time
-
-  def trace_is_enabled():
-    return trace_event_impl.trace_is_enabled()
-
-  def trace_enable(logfile):
-    return trace_event_impl.trace_enable(logfile)
-
-  def trace_disable():
-    return trace_event_impl.trace_disable()
-
-  def trace_flush():
-    trace_event_impl.trace_flush()
-
-  def trace_begin(name, **kwargs):
-    args_to_log = {key: repr(value) for key, value in kwargs.iteritems()}
-    trace_event_impl.add_trace_event("B", time.time(), "python", name, args_to_log)
-
-  def trace_end(name):
-    trace_event_impl.add_trace_event("E", time.time(), "python", name)
-
-  def trace(name, **kwargs):
-    return trace_event_impl.trace(name, **kwargs)
-
-  def traced(fn):
-    return trace_event_impl.traced(fn)
-
-else:
-  import contextlib
-
-  def trace_enable():
+  if _impl():
+    return True
+  try:
+    import importlib.util
+  except ImportError: # Python 2
+    import imp
+    try:
+      imp.find_module("trace_event_impl")
+    except ImportError:
+      return False
+    return True
+  return importlib.util.find_spec("trace_event_impl") != None
+
+def trace_is_enabled():
+  impl = _impl()
+  return bool(impl) and impl.trace_is_enabled()
+
+def trace_enable(logfile=None, ring_buffer_size=None, max_file_size=None,
+                 max_file_age=None, keep_files=None):
+  try:
+    import trace_event_impl
+  except ImportError:
     raise TraceException("Cannot enable trace_event. No trace_event_impl module found.")
-
-  def trace_disable():
+  return trace_event_impl.trace_enable(logfile, ring_buffer_size,
+                                       max_file_size, max_file_age,
+                                       keep_files)
+
+def trace_disable():
+  impl = _impl()
+  if impl:
+    return impl.trace_disable()
+
+def trace_flush():
+  impl = _impl()
+  if impl:
+    impl.trace_flush()
+
+def trace_begin(name, **kwargs):
+  impl = _impl()
+  if impl:
+    args_to_log = {key: repr(value) for key, value in kwargs.items()}
+    impl.add_trace_event("B", time.time(), "python", name, args_to_log)
+
+def trace_end(name):
+  impl = _impl()
+  if impl:
+    impl.add_trace_event("E", time.time(), "python", name)
+
+def trace_counter(name, **values):
+  impl = _impl()
+  if impl:
+    impl.add_trace_event("C", time.time(), "python", name, values)
+
+def trace_flow_begin(name, flow_id=None):
+  impl = _impl()
+  if impl:
+    return impl.trace_flow_begin(name, flow_id)
+  return flow_id
+
+def trace_flow_step(name, flow_id):
+  impl = _impl()
+  if impl:
+    impl.trace_flow_step(name, flow_id)
+
+def trace_flow_end(name, flow_id):
+  impl = _impl()
+  if impl:
+    impl.trace_flow_end(name, flow_id)
+
+def trace_subprocess_environment(env=None):
+  impl = _impl()
+  if impl:
+    return impl.trace_subprocess_environment(env)
+  return dict(os.environ if env == None else env)
+
+class _NoopScope(object):
+  def __enter__(self):
     pass
 
-  def trace_is_enabled():
-    return False
-
-  def trace_flush():
-    pass
-
-  def trace_begin(self, name, **kwargs):
+  def __exit__(self, *exc_info):
     pass
 
-  def trace_end(self, name):
+def trace(name, **kwargs):
+  impl = _impl()
+  if impl:
+    return impl.trace(name, **kwargs)
+  return _NoopScope()
+
+# CO_COROUTINE. Coroutine functions are traced by trace_event_impl right away,
+# since they must stay recognizable as such.
+_CO_COROUTINE = 0x80 if sys.version_info >= (3, 5) else 0
+
+def traced(*args):
+  def get_wrapper(fn):
+    flags = getattr(getattr(fn, "__code__", None), "co_flags", 0)
+    if flags & _CO_COROUTINE and trace_can_enable():
+      import trace_event_impl
+      return trace_event_impl.traced(*arg_names)(fn)
+    impl_traced = []
+
+    def traced_function(*args, **kwargs):
+      impl = _impl()
+      if not impl:
+        return fn(*args, **kwargs)
+      if not impl_traced:
+        impl_traced.append(impl.traced(*arg_names)(fn))
+      return impl_traced[0](*args, **kwargs)
+
+    # What functools.wraps does, without importing functools.
+    for attr in ("__module__", "__name__", "__qualname__", "__doc__"):
+      if hasattr(fn, attr):
+        setattr(traced_function, attr, getattr(fn, attr))
+    traced_function.__dict__.update(getattr(fn, "__dict__", {}))
+    traced_function.__wrapped__ = fn
+    return traced_function
+
+  if len(args) == 1 and callable(args[0]):
+    arg_names = ()
+    return get_wrapper(args[0])
+  arg_names = args
+  return get_wrapper
+
+# Processes started by a traced process trace along, see
+# trace_event_impl.subprocess_shim.
+if "TRACE_EVENT_LOG_FILE" in os.environ or "TRACE_EVENT_STREAM" in os.environ:
+  try:
+    import trace_event_impl
+  except ImportError:
     pass
 
-  @contextlib.contextmanager
-  def trace(name, **kwargs):
-    yield
-
-  def traced(fn):
-    return fn
-
 
 trace_enable.__doc__ = """Enables tracing.
 
   Once enabled, the enabled bit propagates to forked processes and
-  multiprocessing subprocesses. Regular child processes, e.g. those created via
-  os.system/popen, or subprocess.Popen instances, will not get traced. You can,
-  however, enable tracing on those subprocess manually.
+  multiprocessing subprocesses. Python children started with subprocess.Popen
+  trace into the same log file too, as soon as they import trace_event, because
+  the log file, ring buffer size and sampling interval are passed to them in
+  their environment. Children started in other ways, e.g. via os.system, can be
+  given that environment with trace_subprocess_environment().
 
   Trace files are multiprocess safe, so you can have multiple processes
   outputting to the same tracelog at once.
 
-  log_file can be one of three things:
+  log_file can be one of four things:
 
     None: a logfile is opened based on sys[argv], namely
           "./" + sys.argv[0] + ".json"
@@ -133,6 +221,28 @@ trace_enable.__doc__ = """Enables tracing.
 
     file-like object: the fileno() is is used. The underlying file descriptor
                       must support fcntl.lockf() operations.
+
+    trace_event_impl.StreamSink: events are streamed to a collector over a
+                      UNIX domain socket or TCP as they are recorded, e.g. to
+                        python -m trace_event_impl.collector unix:<path> -o <file>
+                      See the StreamSink documentation for its queueing.
+
+  If ring_buffer_size is given, each process records its events into a ring
+  buffer of that many bytes, memory-mapped from a file next to the log file,
+  instead of into memory. Events then survive the process crashing or being
+  killed: trace_disable in the parent, or running
+    python -m trace_event_impl.ring_buffer <log_file>
+  afterwards, appends what such processes left behind to the log file. When
+  a ring buffer fills up between flushes, its oldest events are dropped. This
+  requires log_file to be None or a string.
+
+  If max_file_size (in bytes) or max_file_age (in seconds) is given, a flush
+  that leaves the log file at least that big or old closes it with a trailing
+  ] and renames it from e.g. trace.json to trace.1.json, trace.2.json and so
+  on, so that each rotated file is a complete trace of its own. The next
+  flush, by any process tracing into the same file, starts a new one. With
+  keep_files, only that many rotated files are kept. This requires log_file
+  to be None or a string.
   """
 
 trace_disable.__doc__ =   """Disables tracing, if enabled.
@@ -150,6 +260,13 @@ trace_flush.__doc__ = """Flushes any currently-recorded trace data to disk.
 trace_is_enabled.__doc__ = """Returns whether tracing is enabled.
   """
 
+trace_subprocess_environment.__doc__ = """Returns env, or os.environ, plus what makes a child trace along.
+
+  subprocess.Popen adds this to the environment of the children it starts by
+  itself. Use it when starting processes some other way, e.g.:
+    os.spawnve(os.P_WAIT, sys.executable, argv, trace_subprocess_environment())
+  """
+
 trace_begin.__doc__ = """Records the beginning of an event of the given name.
 
   The building block for performance tracing. A typical example is:
@@ -188,6 +305,50 @@ trace_end.__doc__ = """Records the end of an event of the given name.
   trace_event_viewer UI.
   """
 
+trace_counter.__doc__ = """Records the current value of one or more counters.
+
+  Counters show up as a graph next to the traced slices, which is handy for
+  memory use, queue depths and the like. Each keyword argument is a series of
+  the counter, and the values must be numbers. Example usage:
+    from trace_event import *
+    def process(queue):
+      trace_counter("queue", pending=len(queue), in_flight=in_flight)
+
+  See trace_event_impl.resource_sampling_enable for a sampler that records
+  common process resources this way.
+  """
+
+trace_flow_begin.__doc__ = """Starts a flow that links slices across threads or processes.
+
+  Flows draw an arrow from the slice that is open when trace_flow_begin is
+  called to the slices open when trace_flow_step and trace_flow_end are
+  called with the returned id, for instance in the thread or process that
+  picked up the work. Example usage:
+    from trace_event import *
+    def submit(job):
+      with trace("submit"):
+        job.flow_id = trace_flow_begin("job")
+        queue.put(job)
+
+    def run(job):
+      with trace("run"):
+        trace_flow_end("job", job.flow_id)
+        job()
+
+  Work handed to multiprocessing.Process and concurrent.futures executors is
+  linked automatically.
+  """
+
+trace_flow_step.__doc__ = """Adds the currently open slice to a flow.
+
+  See the documentation for trace_flow_begin for more information.
+  """
+
+trace_flow_end.__doc__ = """Ends a flow in the currently open slice.
+
+  See the documentation for trace_flow_begin for more information.
+  """
+
 trace.__doc__ = """Traces a block of code using a with statement.
 
   Example usage:
@@ -212,4 +373,10 @@ traced.__doc__ = """
     @traced("url")
     def send_request(url):
       urllib2.urlopen(url).read()
+
+  Generators are traced each time they are resumed. Coroutines and async
+  generators are traced as async slices of the task they run in, so that
+  interleaved tasks on one thread do not corrupt each other's nesting. Code
+  running inside such a coroutine, including trace() blocks, is recorded in
+  the same async slice.
   """
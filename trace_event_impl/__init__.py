@@ -1,6 +1,60 @@
 # Copyright 2011 The Chromium Authors. All rights reserved.
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
-from log import *
-from decorators import *
-import multiprocessing_shim
+import importlib
+import os
+import sys
+
+# The public names, by the module that defines them. Modules are imported
+# when one of their names is first used, so that importing trace_event_impl
+# costs next to nothing for programs that never trace.
+_PUBLIC = {
+  "log": ["TraceException", "trace_enable", "trace_disable", "trace_flush",
+          "trace_is_enabled", "add_trace_event", "trace_begin", "trace_end",
+          "trace_counter"],
+  "decorators": ["trace", "traced"],
+  "auto_trace": ["auto_trace_enable", "auto_trace_disable",
+                 "auto_trace_is_enabled"],
+  "sampling": ["sampling_enable", "sampling_disable", "sampling_is_enabled",
+               "resource_sampling_enable", "resource_sampling_disable",
+               "resource_sampling_is_enabled"],
+  "gc_tracing": ["gc_tracing_enable", "gc_tracing_disable",
+                 "gc_tracing_is_enabled"],
+  "alloc_tracing": ["alloc_tracing_enable", "alloc_tracing_disable",
+                    "alloc_tracing_is_enabled"],
+  "streaming": ["StreamSink"],
+  "flow": ["trace_flow_begin", "trace_flow_step", "trace_flow_end",
+           "flow_wrap"],
+  "control": ["tracing_control_enable", "tracing_control_disable",
+              "tracing_control_is_enabled", "latency_trigger_enable",
+              "latency_trigger_disable"],
+  "subprocess_shim": ["trace_subprocess_environment"],
+}
+
+_modules_by_name = {}
+for _module, _names in _PUBLIC.items():
+  for _name in _names:
+    _modules_by_name[_name] = _module
+
+__all__ = sorted(_modules_by_name)
+
+def __getattr__(name):
+  module = _modules_by_name.get(name)
+  if not module:
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+  value = getattr(importlib.import_module(".%s" % module, __name__), name)
+  globals()[name] = value
+  return value
+
+def __dir__():
+  return sorted(set(globals()) | set(__all__))
+
+if sys.version_info < (3, 7):
+  # Modules can only define __getattr__ from Python 3.7 on.
+  for _name in __all__:
+    __getattr__(_name)
+
+# Processes started by a traced process trace along, see subprocess_shim.py.
+if "TRACE_EVENT_LOG_FILE" in os.environ or "TRACE_EVENT_STREAM" in os.environ:
+  from . import subprocess_shim
+  subprocess_shim._enable_from_environment()
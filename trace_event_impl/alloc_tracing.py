@@ -0,0 +1,108 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import itertools
+import sys
+import threading
+
+from . import decorators
+from . import log
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+_started_tracemalloc = False
+
+def alloc_tracing_enable(use_tracemalloc=True):
+  """Records the memory allocated in trace() and @traced scopes.
+
+  The end event of each scope gets a "net_alloc_blocks" arg, the change in
+  the number of memory blocks allocated by the interpreter while the scope
+  ran. With use_tracemalloc, it also gets a "net_alloc_bytes" arg, the change
+  in the bytes traced by tracemalloc, and from Python 3.9 on an
+  "alloc_peak_bytes" arg, how far the traced bytes rose above where they
+  were when the scope began.
+
+  The net counts are what the scope left allocated: memory that it
+  allocated and freed again does not show in them. Only the peak shows such
+  churn, and only its largest transient, not the total allocated. All of
+  them count the allocations of all threads, so they are best read for
+  scopes on threads that dominate allocation. tracemalloc is started if it
+  is not tracing yet, which costs more than counting blocks alone.
+
+  See ParsedTraceEvents.findAllocationHotspots to rank scopes by these.
+  Requires sys.getallocatedblocks, which is available from Python 3.4 on.
+  Generators are counted per resume; coroutines are not counted.
+  """
+  global _started_tracemalloc
+  if not hasattr(sys, "getallocatedblocks"):
+    raise log.TraceException("sys.getallocatedblocks is not supported by this Python")
+  if decorators._alloc_counter:
+    raise log.TraceException("Allocation tracing already enabled")
+  if use_tracemalloc:
+    if not tracemalloc.is_tracing():
+      tracemalloc.start()
+      _started_tracemalloc = True
+    if hasattr(tracemalloc, "reset_peak"):
+      decorators._alloc_counter = _PeakCounter()
+    else:
+      decorators._alloc_counter = _TracedCounter()
+  else:
+    decorators._alloc_counter = _BlockCounter()
+
+def alloc_tracing_disable():
+  global _started_tracemalloc
+  if not decorators._alloc_counter:
+    return
+  decorators._alloc_counter = None
+  if _started_tracemalloc:
+    _started_tracemalloc = False
+    tracemalloc.stop()
+
+def alloc_tracing_is_enabled():
+  return decorators._alloc_counter != None
+
+class _BlockCounter(object):
+  def begin(self):
+    return (sys.getallocatedblocks(),)
+
+  def end(self, before):
+    return {"net_alloc_blocks": sys.getallocatedblocks() - before[0]}
+
+class _TracedCounter(_BlockCounter):
+  def begin(self):
+    return (sys.getallocatedblocks(), tracemalloc.get_traced_memory()[0])
+
+  def end(self, before):
+    args = _BlockCounter.end(self, before)
+    args["net_alloc_bytes"] = tracemalloc.get_traced_memory()[0] - before[1]
+    return args
+
+class _PeakCounter(_TracedCounter):
+  """Also records peaks. tracemalloc has a single peak, which every scope
+  resets when it begins. The peak reached until then is folded into the
+  scopes that are open at that time, on any thread."""
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._tokens = itertools.count()
+    self._peaks = {} # token of an open scope -> its peak so far
+
+  def begin(self):
+    with self._lock:
+      current, peak = tracemalloc.get_traced_memory()
+      for token in self._peaks:
+        self._peaks[token] = max(self._peaks[token], peak)
+      tracemalloc.reset_peak()
+      token = next(self._tokens)
+      self._peaks[token] = current
+    return (sys.getallocatedblocks(), current, token)
+
+  def end(self, before):
+    args = _TracedCounter.end(self, before)
+    with self._lock:
+      peak = max(self._peaks.pop(before[2], 0),
+                 tracemalloc.get_traced_memory()[1])
+    args["alloc_peak_bytes"] = peak - before[1]
+    return args
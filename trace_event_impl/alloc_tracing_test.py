@@ -0,0 +1,77 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import sys
+import unittest
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+from .alloc_tracing import *
+from .decorators import *
+from .log import *
+from .trace_test import *
+
+@traced
+def allocate(n):
+  return [bytearray(1000) for i in range(n)]
+
+@unittest.skipIf(not hasattr(sys, "getallocatedblocks"),
+                 "requires sys.getallocatedblocks")
+class AllocTracingTest(TraceTest):
+  def tearDown(self):
+    alloc_tracing_disable()
+    TraceTest.tearDown(self)
+
+  def test_scopes_record_allocations(self):
+    kept = []
+    def work():
+      alloc_tracing_enable()
+      with trace("outer"):
+        kept.append(allocate(100))
+        kept.append(allocate(10))
+    res = self.go(work)
+    end = res.findByName("outer").findByPhase("E")[0]
+    self.assertTrue(end["args"]["net_alloc_bytes"] >= 110000)
+    self.assertTrue(end["args"]["net_alloc_blocks"] >= 110)
+    hotspots = res.findAllocationHotspots()
+    self.assertEquals("%s.allocate" % __name__, hotspots[0]["name"])
+    self.assertEquals(2, hotspots[0]["count"])
+    self.assertTrue(hotspots[0]["self"] >= 110000)
+
+  @unittest.skipIf(not hasattr(tracemalloc, "reset_peak"),
+                   "requires tracemalloc.reset_peak")
+  def test_peak_shows_churn(self):
+    def work():
+      alloc_tracing_enable()
+      with trace("outer"):
+        for i in range(10):
+          allocate(1000)
+    res = self.go(work)
+    outer = res.findByName("outer").findByPhase("E")[0]["args"]
+    self.assertTrue(outer["net_alloc_bytes"] < 100000)
+    self.assertTrue(outer["alloc_peak_bytes"] >= 1000000)
+    for end in res.findByName("%s.allocate" % __name__).findByPhase("E"):
+      self.assertTrue(end["args"]["alloc_peak_bytes"] >= 1000000)
+    hotspots = res.findAllocationHotspots("alloc_peak_bytes")
+    self.assertEquals("%s.allocate" % __name__, hotspots[0]["name"])
+
+  def test_blocks_only(self):
+    kept = []
+    def work():
+      alloc_tracing_enable(use_tracemalloc=False)
+      kept.append(allocate(100))
+    res = self.go(work)
+    end = res.findByName("%s.allocate" % __name__).findByPhase("E")[0]
+    self.assertFalse("net_alloc_bytes" in end["args"])
+    self.assertTrue(end["args"]["net_alloc_blocks"] >= 100)
+
+  def test_enable_twice_fails(self):
+    alloc_tracing_enable(use_tracemalloc=False)
+    self.assertRaises(TraceException, alloc_tracing_enable)
+
+@unittest.skipIf(hasattr(sys, "getallocatedblocks"),
+                 "sys.getallocatedblocks is supported")
+class AllocTracingUnsupportedTest(unittest.TestCase):
+  def test_enable_fails(self):
+    self.assertRaises(TraceException, alloc_tracing_enable)
@@ -0,0 +1,155 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import sys
+import threading
+import time
+
+from . import log
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
+_enabled = False
+_prefixes = ()
+_min_duration = 0
+_trace_c_calls = True
+
+# Filter decisions are cached so that calls outside the traced modules only
+# cost a dictionary lookup. Both map to the event name, or None if filtered.
+_code_names = {}   # code object -> name
+_c_modules = {}    # module name of a C function -> bool
+
+# Sentinel for code living in the log module. That code runs with the log lock
+# held, so nothing it calls may be recorded.
+_INTERNAL = object()
+
+_tls = threading.local()
+
+def auto_trace_enable(modules, min_duration=0, c_calls=True):
+  """Automatically traces every call into the given modules.
+
+  modules is a list of module or package names. A call is traced when the
+  module defining the called function is one of them or lives inside one of
+  them. With c_calls, calls to C functions of those modules are traced too,
+  e.g. auto_trace_enable(["json", "time"]).
+
+  Calls shorter than min_duration seconds are not recorded. Use this to keep
+  the trace size manageable when tracing busy code.
+
+  The current thread and threads started afterwards are traced. Threads that
+  already exist are not. Events are only recorded while tracing is enabled.
+  """
+  global _enabled, _prefixes, _min_duration, _trace_c_calls
+  if _enabled:
+    raise log.TraceException("Auto tracing already enabled")
+  if isinstance(modules, basestring):
+    modules = [modules]
+  _prefixes = tuple(modules)
+  _min_duration = min_duration
+  _trace_c_calls = c_calls
+  _code_names.clear()
+  _c_modules.clear()
+  _enabled = True
+  threading.setprofile(_profile)
+  sys.setprofile(_profile)
+
+def auto_trace_disable():
+  """Stops automatic tracing.
+
+  Other threads stop tracing the next time they call a function.
+  """
+  global _enabled
+  if not _enabled:
+    return
+  _enabled = False
+  threading.setprofile(None)
+  sys.setprofile(None)
+
+def auto_trace_is_enabled():
+  return _enabled
+
+def _module_is_traced(module):
+  for prefix in _prefixes:
+    if module == prefix or module.startswith(prefix + "."):
+      return True
+  return False
+
+def _name_for_frame(frame):
+  if frame.f_globals is log.__dict__:
+    return _INTERNAL
+  module = frame.f_globals.get("__name__")
+  if not module or not _module_is_traced(module):
+    return None
+  code = frame.f_code
+  return "%s.%s" % (module, getattr(code, "co_qualname", code.co_name))
+
+def _name_for_c_function(fn):
+  module = getattr(fn, "__module__", None)
+  if module == None:
+    # Methods of builtin types have no module, but their type does.
+    module = type(getattr(fn, "__self__", None)).__module__
+  try:
+    traced = _c_modules[module]
+  except KeyError:
+    traced = _c_modules[module] = bool(module) and _module_is_traced(module)
+  if not traced:
+    return None
+  return "%s.%s" % (module, fn.__name__)
+
+def _profile(frame, event, arg):
+  # Everything in here runs for every call in the process and must be fast.
+  if not _enabled:
+    sys.setprofile(None)
+    return
+  try:
+    stack = _tls.stack
+  except AttributeError:
+    stack = _tls.stack = []
+    _tls.internal = None
+
+  # Before checking log._enabled, since trace_disable is internal too.
+  if _tls.internal:
+    if event == "return" and frame is _tls.internal:
+      _tls.internal = None
+    return
+
+  if not log._enabled:
+    # Returns go unseen while tracing is disabled, so drop what is pending.
+    if stack:
+      del stack[:]
+    return
+
+  if event == "call":
+    code = frame.f_code
+    try:
+      name = _code_names[code]
+    except KeyError:
+      name = _code_names[code] = _name_for_frame(frame)
+    if name is None:
+      return
+    if name is _INTERNAL:
+      _tls.internal = frame
+      return
+    stack.append((frame, name, time.time()))
+  elif event == "return":
+    if stack and stack[-1][0] is frame:
+      _record(stack.pop())
+  elif event == "c_call":
+    if not _trace_c_calls:
+      return
+    name = _name_for_c_function(arg)
+    if name is None:
+      return
+    stack.append((arg, name, time.time()))
+  else: # c_return or c_exception
+    if stack and stack[-1][0] is arg:
+      _record(stack.pop())
+
+def _record(entry):
+  _, name, start = entry
+  dur = time.time() - start
+  if dur >= _min_duration:
+    log.add_trace_event("X", start, "python", name, dur=dur)
@@ -0,0 +1,79 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import time
+import unittest
+from . import auto_trace
+from .auto_trace import *
+from .log import *
+from .trace_test import *
+
+def leaf():
+  time.sleep(0.01)
+
+def root():
+  leaf()
+  leaf()
+
+def restart_tracing(log_file):
+  trace_disable()
+  leaf()
+  trace_enable(log_file)
+
+def fast():
+  pass
+
+def slow():
+  time.sleep(0.05)
+
+class AutoTraceTest(TraceTest):
+  def tearDown(self):
+    auto_trace_disable()
+    TraceTest.tearDown(self)
+
+  def _auto_trace(self, cb, *args, **kwargs):
+    def work():
+      auto_trace_enable(*args, **kwargs)
+      try:
+        cb()
+      finally:
+        auto_trace_disable()
+    return self.go(work)
+
+  def test_traces_module_functions(self):
+    res = self._auto_trace(root, [__name__], c_calls=False)
+    names = [e["name"] for e in res.findByPhase("X")]
+    self.assertEquals(["%s.leaf" % __name__,
+                       "%s.leaf" % __name__,
+                       "%s.root" % __name__], names)
+    root_event = res.findByName("%s.root" % __name__)[0]
+    self.assertTrue(root_event["dur"] >= 20000)
+
+  def test_ignores_other_modules(self):
+    res = self._auto_trace(root, ["some_other_module"])
+    self.assertEquals(0, len(res.findByPhase("X")))
+
+  def test_min_duration(self):
+    def work():
+      fast()
+      slow()
+    res = self._auto_trace(work, [__name__], min_duration=0.02, c_calls=False)
+    self.assertEquals(0, len(res.findByName("%s.fast" % __name__)))
+    self.assertEquals(1, len(res.findByName("%s.slow" % __name__)))
+
+  def test_c_calls(self):
+    res = self._auto_trace(leaf, ["time"])
+    self.assertEquals(1, len(res.findByName("time.sleep")))
+
+  def test_survives_disable_and_enable(self):
+    def work():
+      restart_tracing(self.trace_filename)
+      leaf()
+    res = self._auto_trace(work, [__name__], c_calls=False)
+    self.assertEquals(["%s.leaf" % __name__],
+                      [e["name"] for e in res.findByPhase("X")])
+    self.assertEquals([], auto_trace._tls.stack)
+
+  def test_enable_twice_fails(self):
+    auto_trace_enable([__name__])
+    self.assertRaises(TraceException, lambda: auto_trace_enable([__name__]))
@@ -0,0 +1,189 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import argparse
+import copy
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from . import streaming
+
+class Collector(object):
+  """Receives the events that StreamSinks stream to address.
+
+  Events of all connected processes are written to output, if given, as one
+  trace file, which close() terminates with a ]. metrics() summarizes what
+  was received. Starts listening right away; call start() or serve_forever()
+  to accept connections.
+  """
+  def __init__(self, address, output=None):
+    if not isinstance(address, tuple) and os.path.exists(address):
+      os.unlink(address) # Left behind by a collector that was killed.
+    self._socket = socket.socket(streaming._family(address),
+                                 socket.SOCK_STREAM)
+    if isinstance(address, tuple):
+      self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._socket.bind(address)
+    self._socket.listen(16)
+    # Polls for close(), since closing a socket does not wake up accept().
+    self._socket.settimeout(0.2)
+    self.address = address
+    if isinstance(address, tuple):
+      self.address = self._socket.getsockname()[:2]
+    self._output = open(output, "w") if output else None
+    self._output_empty = True
+    self._lock = threading.Lock()
+    self._connections = set()
+    self._closed = False
+    self._thread = None
+    self._stacks = {} # (pid, tid) -> open B events, kept across resets
+    self._reset_metrics()
+
+  def start(self):
+    """Accepts connections on a background thread."""
+    self._thread = threading.Thread(target=self.serve_forever,
+                                    name="trace_event_collector")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def serve_forever(self):
+    while not self._closed:
+      try:
+        conn, address = self._socket.accept()
+      except socket.timeout:
+        continue
+      except socket.error:
+        if self._closed:
+          break
+        raise
+      conn.settimeout(None)
+      with self._lock:
+        self._connections.add(conn)
+      t = threading.Thread(target=self._receive, args=(conn,))
+      t.daemon = True
+      t.start()
+
+  def close(self, timeout=1.0):
+    """Stops accepting connections, and waits up to timeout seconds for the
+    connected processes to finish sending before cutting them off."""
+    self._closed = True
+    if self._thread:
+      self._thread.join()
+    self._socket.close()
+    deadline = time.time() + timeout
+    while self._connections and time.time() < deadline:
+      time.sleep(0.01)
+    with self._lock:
+      for conn in self._connections:
+        try:
+          conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+          pass
+      self._connections.clear()
+      if self._output:
+        self._output.write("[]" if self._output_empty else "\n]\n")
+        self._output.close()
+        self._output = None
+    if not isinstance(self.address, tuple):
+      os.unlink(self.address)
+
+  def metrics(self, reset=False):
+    """Returns what was received since the last reset.
+
+    "events" and "processes" count events overall and per pid. "dropped" is
+    the latest count of events each pid's sink had to drop. "slices" holds
+    the count, total and maximum duration in microseconds of the slices that
+    ended, by name.
+    """
+    with self._lock:
+      metrics = {"events": self._events, "processes": self._processes,
+                 "dropped": self._dropped, "slices": self._slices}
+      if reset:
+        self._reset_metrics()
+      else:
+        metrics = copy.deepcopy(metrics)
+    return metrics
+
+  def _reset_metrics(self):
+    self._events = 0
+    self._processes = {}
+    self._dropped = {}
+    self._slices = {}
+
+  def _receive(self, conn):
+    f = conn.makefile("rb")
+    try:
+      while True:
+        try:
+          line = f.readline()
+        except socket.error:
+          break
+        if not line:
+          break
+        try:
+          event = json.loads(line.decode("utf-8"))
+        except ValueError:
+          continue # Cut off when the sender reconnected.
+        self._add(event)
+    finally:
+      f.close()
+      conn.close()
+      with self._lock:
+        self._connections.discard(conn)
+
+  def _add(self, event):
+    with self._lock:
+      if self._output:
+        self._output.write("[" if self._output_empty else ",\n")
+        self._output.write(json.dumps(event))
+        self._output.flush()
+        self._output_empty = False
+      self._events += 1
+      pid = event.get("pid")
+      self._processes[pid] = self._processes.get(pid, 0) + 1
+      ph = event.get("ph")
+      if ph == "C" and event.get("name") == "trace_event_stream":
+        self._dropped[pid] = event["args"]["dropped"]
+      elif ph == "X":
+        self._add_slice(event["name"], event.get("dur", 0))
+      elif ph == "B":
+        self._stacks.setdefault((pid, event.get("tid")), []).append(event)
+      elif ph == "E":
+        stack = self._stacks.get((pid, event.get("tid")))
+        if stack:
+          begin = stack.pop()
+          self._add_slice(begin["name"], event["ts"] - begin["ts"])
+
+  def _add_slice(self, name, dur):
+    s = self._slices.setdefault(name, {"count": 0, "total": 0, "max": 0})
+    s["count"] += 1
+    s["total"] += dur
+    s["max"] = max(s["max"], dur)
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+      description="Collects the trace events streamed by StreamSinks.")
+  parser.add_argument("address", help="unix:<path> or tcp:<host>:<port>")
+  parser.add_argument("-o", "--output", help="trace file to write")
+  parser.add_argument("--metrics-interval", type=float,
+                      help="print metrics as JSON every this many seconds")
+  args = parser.parse_args(argv)
+  collector = Collector(streaming.parse_address(args.address), args.output)
+  collector.start()
+  try:
+    while True:
+      time.sleep(args.metrics_interval or 1.0)
+      if args.metrics_interval:
+        print(json.dumps(collector.metrics(reset=True), sort_keys=True))
+        sys.stdout.flush()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    collector.close()
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
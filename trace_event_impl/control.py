@@ -0,0 +1,270 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import os
+import signal
+import threading
+import warnings
+
+from . import decorators
+from . import log
+from . import sampling
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
+# Signals and control file commands act on tracing from the control thread,
+# never from the signal handler: the handler may interrupt code that holds
+# the log lock.
+ENABLE_SIGNAL = signal.SIGUSR1
+DISABLE_SIGNAL = signal.SIGUSR2
+
+_settings = None
+_control_thread = None
+_pending = [] # commands queued by the signal handlers
+_previous_handlers = {}
+_control_file_state = None
+
+# Serializes enabling and disabling from control commands and triggers.
+_lock = threading.RLock()
+# The _LatencyTrigger that enabled tracing and the log file it opened, if any.
+_triggered = None
+
+def tracing_control_enable(log_file=None, ring_buffer_size=None, signals=True,
+                           control_file=None, poll_interval=0.2):
+  """Lets tracing be enabled, disabled and flushed while the process runs.
+
+  With signals set, SIGUSR1 enables tracing into log_file, or flushes it if
+  tracing is already enabled, and SIGUSR2 disables it. Signal handlers can
+  only be installed from the main thread. With a control_file, writing
+  "enable", "disable" or "flush" to it does the same; the file is checked
+  every poll_interval seconds, which also bounds how long signals take to act.
+
+  Control outlives and overrides the restrictions of multiprocessing
+  children: they pick up the same settings and act on the control file, and
+  on signals sent to them, e.g. to the whole process group with
+    kill -USR1 -- -<pgid>
+  log_file must then be None or a string.
+  """
+  if _settings:
+    raise log.TraceException("Tracing control already enabled")
+  if log_file != None and not isinstance(log_file, basestring):
+    raise log.TraceException("Tracing control requires a log file name")
+  control_file = control_file and os.path.abspath(control_file)
+  # Commands written before control started are not replayed.
+  _start({"log_file": log_file or log._default_log_file_name(),
+          "ring_buffer_size": ring_buffer_size,
+          "signals": signals,
+          "control_file": control_file,
+          "poll_interval": poll_interval,
+          "triggers": {}},
+         control_file and _stat_control_file(control_file))
+
+def tracing_control_disable():
+  """Stops acting on signals and the control file. Leaves tracing as is."""
+  global _settings, _control_thread
+  if not _settings:
+    return
+  if _control_thread:
+    _control_thread.stop()
+    _control_thread = None
+  for signum, handler in _previous_handlers.items():
+    signal.signal(signum, handler)
+  _previous_handlers.clear()
+  del _pending[:]
+  if not _settings["triggers"]:
+    _settings = None
+  else:
+    _settings.update(signals=False, control_file=None, poll_interval=None)
+
+def tracing_control_is_enabled():
+  return _control_thread != None
+
+def latency_trigger_enable(name, threshold, duration, log_file=None,
+                           ring_buffer_size=None):
+  """Records a trace for duration seconds whenever a call is too slow.
+
+  name is the name the @traced function is recorded under, e.g.
+  "module.function" or "Class.method". When a call to it takes threshold
+  seconds or longer while tracing is disabled, tracing is enabled into
+  log_file, starting with a slice for that call, and disabled again duration
+  seconds later. Tracing enabled by other means is left alone.
+
+  Until it fires, the cost is a dictionary lookup per call to an @traced
+  function, plus building the recorded name of calls to methods named like
+  the trigger's last component. Generators and coroutines do not fire
+  triggers.
+  """
+  global _settings
+  if log_file != None and not isinstance(log_file, basestring):
+    raise log.TraceException("Latency triggers require a log file name")
+  if not _settings:
+    _settings = {"log_file": None, "ring_buffer_size": None, "signals": False,
+                 "control_file": None, "poll_interval": None, "triggers": {}}
+  _settings["triggers"][name] = (threshold, duration,
+                                 log_file or log._default_log_file_name(),
+                                 ring_buffer_size)
+  decorators._latency_triggers.setdefault(name.rsplit(".", 1)[-1], {})[name] = (
+      _LatencyTrigger(name, *_settings["triggers"][name]))
+
+def latency_trigger_disable(name=None):
+  """Removes the trigger for name, or all triggers if name is None."""
+  global _settings
+  if not _settings:
+    return
+  names = [name] if name != None else list(_settings["triggers"])
+  for n in names:
+    _settings["triggers"].pop(n, None)
+    func_name = n.rsplit(".", 1)[-1]
+    triggers = decorators._latency_triggers.get(func_name, {})
+    triggers.pop(n, None)
+    if not triggers:
+      decorators._latency_triggers.pop(func_name, None)
+  if not _settings["triggers"] and not _control_thread:
+    _settings = None
+
+class _LatencyTrigger(object):
+  def __init__(self, name, threshold, duration, log_file, ring_buffer_size):
+    self.name = name
+    self.threshold = threshold
+    self.duration = duration
+    self.log_file = log_file
+    self.ring_buffer_size = ring_buffer_size
+
+  def __call__(self, start, elapsed):
+    if elapsed >= self.threshold:
+      _fire(self, start, elapsed)
+
+def _fire(trigger, start, elapsed):
+  global _triggered
+  with _lock:
+    if log._enabled:
+      return
+    if not _enable(trigger.log_file, trigger.ring_buffer_size):
+      return
+    _triggered = (trigger, log._log_file)
+    log.add_trace_event("X", start, "python", trigger.name,
+                        {"latency_trigger": repr(trigger.threshold)},
+                        dur=elapsed)
+    timer = threading.Timer(trigger.duration, _end_triggered, (_triggered,))
+  timer.daemon = True
+  timer.start()
+
+def _end_triggered(triggered):
+  global _triggered
+  with _lock:
+    if _triggered is triggered:
+      _triggered = None
+      # Unless tracing was disabled and enabled again in the meantime.
+      if log._log_file is triggered[1]:
+        log._trace_disable()
+
+def _enable(log_file, ring_buffer_size):
+  # Bypasses the restrictions of multiprocessing children on purpose.
+  try:
+    log._trace_enable(log_file, ring_buffer_size)
+  except (EnvironmentError, log.TraceException) as e:
+    warnings.warn("trace_event: could not enable tracing: %s" % e)
+    return False
+  return True
+
+def _execute(command):
+  global _triggered
+  with _lock:
+    if command == "enable":
+      if log._enabled:
+        log.trace_flush()
+      else:
+        _enable(_settings["log_file"], _settings["ring_buffer_size"])
+    elif command == "disable":
+      _triggered = None
+      log._trace_disable()
+    elif command == "flush":
+      log.trace_flush()
+    else:
+      warnings.warn("trace_event: unknown tracing control command %r" %
+                    command)
+
+def _handle_signal(signum, frame):
+  _pending.append("enable" if signum == ENABLE_SIGNAL else "disable")
+
+def _stat_control_file(path):
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  return (st.st_ino, st.st_mtime, st.st_size)
+
+def _poll():
+  global _control_file_state
+  while _pending:
+    _execute(_pending.pop(0))
+  if not _settings["control_file"]:
+    return
+  state = _stat_control_file(_settings["control_file"])
+  if state == _control_file_state:
+    return
+  _control_file_state = state
+  if state == None:
+    return
+  try:
+    with open(_settings["control_file"]) as f:
+      command = f.read().strip()
+  except EnvironmentError:
+    return
+  if command:
+    _execute(command)
+
+class _ControlThread(sampling._PeriodicThread):
+  def run(self):
+    # Unlike the samplers, control must act while tracing is disabled.
+    while not self._stopped.is_set():
+      self._sample()
+      self._stopped.wait(self._interval)
+
+def _start(settings, control_file_state):
+  global _settings, _control_thread, _control_file_state
+  triggers = _settings["triggers"] if _settings else {}
+  _settings = settings
+  _settings["triggers"].update(triggers)
+  if settings["signals"]:
+    for signum in (ENABLE_SIGNAL, DISABLE_SIGNAL):
+      previous = signal.signal(signum, _handle_signal)
+      # Forked children inherit our handlers, but not the ones they replaced.
+      _previous_handlers.setdefault(signum, previous)
+  _control_file_state = control_file_state
+  _control_thread = _ControlThread(
+      "trace_event_control", settings["poll_interval"], _poll)
+  _control_thread.start()
+
+def _current_settings():
+  """Returns what _restore needs to resume control in a child process."""
+  if not _settings:
+    return None
+  # The child acts on the commands this process did not see yet, too.
+  return (_settings, _control_file_state)
+
+def _restore(current_settings):
+  """Resumes tracing control in a multiprocessing child.
+
+  Threads do not survive forking and nothing survives spawning, so start
+  over from the parent's settings.
+  """
+  global _settings, _control_thread, _triggered
+  _settings = None
+  _control_thread = None
+  _triggered = None
+  del _pending[:]
+  decorators._latency_triggers.clear()
+  if not current_settings:
+    return
+  settings, control_file_state = current_settings
+  for name, trigger in settings["triggers"].items():
+    latency_trigger_enable(name, *trigger)
+  if settings["poll_interval"] != None:
+    settings = dict(settings, triggers={})
+    if not isinstance(threading.current_thread(), threading._MainThread):
+      settings["signals"] = False
+    _start(settings, control_file_state)
@@ -0,0 +1,141 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+import unittest
+from .control import *
+from .decorators import *
+from .log import *
+from .trace_test import *
+
+def _wait_until(condition, timeout=5.0):
+  deadline = time.time() + timeout
+  while not condition():
+    if time.time() > deadline:
+      return False
+    time.sleep(0.01)
+  return True
+
+def _write(path, command):
+  with open(path, "w") as f:
+    f.write(command)
+
+@traced
+def fast():
+  pass
+
+@traced
+def slow():
+  time.sleep(0.05)
+
+class Slow(object):
+  @traced
+  def slow(self):
+    time.sleep(0.05)
+
+class AlsoSlow(Slow):
+  pass
+
+def TraceWhenEnabled():
+  _wait_until(trace_is_enabled)
+  trace_begin("child")
+  trace_end("child")
+  _wait_until(lambda: not trace_is_enabled())
+
+class ControlTest(TraceTest):
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self.log_file = os.path.join(self._dir, "trace.json")
+    self.control_file = os.path.join(self._dir, "control")
+
+  def tearDown(self):
+    tracing_control_disable()
+    latency_trigger_disable()
+    TraceTest.tearDown(self)
+    for name in os.listdir(self._dir):
+      os.unlink(os.path.join(self._dir, name))
+    os.rmdir(self._dir)
+
+  def test_control_file(self):
+    _write(self.control_file, "disable")
+    tracing_control_enable(self.log_file, signals=False,
+                           control_file=self.control_file, poll_interval=0.01)
+    self.assertTrue(tracing_control_is_enabled())
+    # Commands written before control started are ignored.
+    time.sleep(0.05)
+    self.assertFalse(trace_is_enabled())
+    _write(self.control_file, "enable")
+    self.assertTrue(_wait_until(trace_is_enabled))
+    trace_begin("work")
+    trace_end("work")
+    _write(self.control_file, "disable\n")
+    self.assertTrue(_wait_until(lambda: not trace_is_enabled()))
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    self.assertEquals(2, len(res.findByName("work")))
+
+  def test_signals(self):
+    tracing_control_enable(self.log_file, poll_interval=0.01)
+    os.kill(os.getpid(), signal.SIGUSR1)
+    self.assertTrue(_wait_until(trace_is_enabled))
+    trace_begin("work")
+    trace_end("work")
+    os.kill(os.getpid(), signal.SIGUSR2)
+    self.assertTrue(_wait_until(lambda: not trace_is_enabled()))
+    tracing_control_disable()
+    self.assertEquals(signal.SIG_DFL, signal.getsignal(signal.SIGUSR1))
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    self.assertEquals(2, len(res.findByName("work")))
+
+  def test_control_in_child(self):
+    tracing_control_enable(self.log_file, signals=False,
+                           control_file=self.control_file, poll_interval=0.01)
+    p = multiprocessing.Process(target=TraceWhenEnabled)
+    p.start()
+    _write(self.control_file, "enable")
+    self.assertTrue(_wait_until(trace_is_enabled))
+    time.sleep(0.1)
+    _write(self.control_file, "disable")
+    p.join()
+    self.assertEquals(0, p.exitcode)
+    self.assertTrue(_wait_until(lambda: not trace_is_enabled()))
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    child_events = res.findByName("child")
+    self.assertEquals(2, len(child_events))
+    self.assertEquals(p.pid, child_events[0]["pid"])
+
+  def test_latency_trigger(self):
+    latency_trigger_enable("%s.slow" % __name__, 0.01, 0.2, self.log_file)
+    fast()
+    self.assertFalse(trace_is_enabled())
+    slow()
+    self.assertTrue(trace_is_enabled())
+    fast()
+    self.assertTrue(_wait_until(lambda: not trace_is_enabled()))
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    slow_events = res.findByName("%s.slow" % __name__)
+    self.assertEquals(1, len(slow_events))
+    self.assertEquals("X", slow_events[0]["ph"])
+    self.assertTrue(slow_events[0]["dur"] >= 10000)
+    self.assertEquals(2, len(res.findByName("%s.fast" % __name__)))
+
+  def test_latency_trigger_leaves_tracing_alone(self):
+    latency_trigger_enable("%s.slow" % __name__, 0.01, 0.01, self.log_file)
+    trace_enable(self.log_file)
+    slow()
+    time.sleep(0.05)
+    self.assertTrue(trace_is_enabled())
+
+  def test_latency_trigger_on_method(self):
+    latency_trigger_enable("AlsoSlow.slow", 0.01, 0.2, self.log_file)
+    slow()
+    Slow().slow()
+    self.assertFalse(trace_is_enabled())
+    AlsoSlow().slow()
+    self.assertTrue(trace_is_enabled())
+    self.assertTrue(_wait_until(lambda: not trace_is_enabled()))
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    self.assertEquals(1, len(res.findByName("AlsoSlow.slow")))
@@ -1,53 +1,265 @@
 # Copyright 2011 The Chromium Authors. All rights reserved.
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
-import contextlib
-import inspect
+import itertools
+import sys
 import time
 import functools
 
-import log
+from . import log
+
+try:
+  import contextvars
+except ImportError:
+  contextvars = None
+
+# Code flags, as in the inspect module, which is too slow to import eagerly.
+_CO_GENERATOR = 0x20
+_CO_COROUTINE = 0x80 if sys.version_info >= (3, 5) else 0
+_CO_ASYNC_GENERATOR = 0x200 if sys.version_info >= (3, 6) else 0
+
+def _code_flags(func):
+  return getattr(getattr(func, "__code__", None), "co_flags", 0)
+
+def _arg_spec(func):
+  """Returns the names of the positional arguments of func and their
+  defaults, like inspect.getfullargspec."""
+  code = getattr(func, "__code__", None)
+  if code:
+    return list(code.co_varnames[:code.co_argcount]), func.__defaults__
+  import inspect
+  getargspec = getattr(inspect, "getfullargspec", None) or inspect.getargspec
+  arg_spec = getargspec(func)
+  return arg_spec.args, arg_spec.defaults
+
+if _CO_COROUTINE:
+  # From source, since async def is a syntax error before Python 3.5.
+  exec("""def _coroutine_function(fn):
+  async def coroutine_function(*args, **kwargs):
+    return await fn(*args, **kwargs)
+  return coroutine_function
+""")
+
+# The async scope the current code runs in, as a (task, id) tuple. Coroutines
+# interleave on a thread, so B/E events recorded from them would not nest.
+# Inside an async scope, trace() and @traced record async ("b"/"e") events
+# keyed by the scope's id instead.
+if contextvars:
+  _async_scope = contextvars.ContextVar("trace_event_async_scope", default=None)
+else:
+  _async_scope = None
+
+_async_ids = itertools.count(1)
+
+# Called with the start time and duration of calls to the @traced functions
+# they are keyed by, while tracing is disabled. Keyed by the function's own
+# name, then by the name it is recorded under. See control.py.
+_latency_triggers = {}
+
+# Set when allocations are recorded for trace() and @traced scopes. Its begin()
+# is called when a scope begins, and what it returned is passed to its end(),
+# which returns the args of the scope's end event. See alloc_tracing.py.
+_alloc_counter = None
+
+def _current_task():
+  asyncio = sys.modules.get("asyncio")
+  if asyncio and hasattr(asyncio, "current_task"):
+    try:
+      return asyncio.current_task()
+    except RuntimeError: # No running event loop.
+      pass
+  return None
+
+def _current_async_id():
+  scope = _async_scope and _async_scope.get()
+  # Tasks inherit the scope of the code that created them, so check that it
+  # really belongs to the running task.
+  if scope and scope[0] is _current_task():
+    return scope[1]
+  return None
+
+def _begin(category, name, args):
+  """Opens a scope and returns what _end needs to close it."""
+  async_id = _current_async_id()
+  if async_id != None:
+    log.add_trace_event("b", time.time(), category, name, args, id=async_id)
+    return (async_id, None)
+  log.add_trace_event("B", time.time(), category, name, args)
+  # Counted after recording, so that recording is not attributed to the scope.
+  return (None, _alloc_counter and log._enabled and _alloc_counter.begin())
+
+def _end(category, name, scope):
+  async_id, allocated = scope
+  if async_id != None:
+    log.add_trace_event("e", time.time(), category, name, id=async_id)
+    return
+  args = None
+  if allocated and _alloc_counter:
+    args = _alloc_counter.end(allocated)
+  log.add_trace_event("E", time.time(), category, name, args)
+
+class _TraceScope(object):
+  def __init__(self, name, kwargs):
+    self._name = name
+    self._kwargs = kwargs
+    self._scope = None
+
+  def __enter__(self):
+    args_to_log = {key: repr(value) for key, value in self._kwargs.items()}
+    self._scope = _begin("python", self._name, args_to_log)
+
+  def __exit__(self, *exc_info):
+    _end("python", self._name, self._scope)
 
-@contextlib.contextmanager
 def trace(name, **kwargs):
-  category = "python"
-  start = time.time()
-  args_to_log = {key: repr(value) for key, value in kwargs.iteritems()}
-  log.add_trace_event("B", start, category, name, args_to_log)
-  try:
-    yield
-  finally:
-    end = time.time()
-    log.add_trace_event("E", end, category, name)
+  return _TraceScope(name, kwargs)
+
+class _TracedResumable(object):
+  """Traces a generator, coroutine or other awaitable while it runs.
+
+  Generators are traced each time they are resumed. Awaitables are traced as
+  a single async slice from their first resume until they finish, keyed by
+  the async scope they run in, and they run inside that scope.
+  """
+  def __init__(self, inner, category, name, args, is_async):
+    self._inner = inner
+    self._category = category
+    self._name = name
+    self._args = args
+    self._is_async = is_async
+    self._scope = None
+    self._done = False
+
+  def __iter__(self):
+    return self
+
+  def __await__(self):
+    return self
+
+  def __next__(self):
+    return self.send(None)
+  next = __next__
+
+  def send(self, value):
+    return self._resume(self._inner.send, value)
+
+  def throw(self, *exc_info):
+    return self._resume(self._inner.throw, *exc_info)
+
+  def close(self):
+    try:
+      self._inner.close()
+    finally:
+      self._finish()
+
+  def _resume(self, fn, *args):
+    if not self._is_async:
+      scope = _begin(self._category, self._name, self._args)
+      try:
+        return fn(*args)
+      finally:
+        _end(self._category, self._name, scope)
+
+    if not self._scope:
+      task = _current_task()
+      async_id = _current_async_id()
+      if async_id == None:
+        async_id = next(_async_ids)
+      self._scope = (task, async_id)
+      log.add_trace_event("b", time.time(), self._category, self._name,
+                          self._args, id=async_id)
+    token = _async_scope and _async_scope.set(self._scope)
+    try:
+      return fn(*args)
+    except BaseException:
+      # Any exception, StopIteration included, means the awaitable finished.
+      self._finish()
+      raise
+    finally:
+      if token:
+        _async_scope.reset(token)
+
+  def _finish(self):
+    if self._done or not self._scope:
+      return
+    self._done = True
+    log.add_trace_event("e", time.time(), self._category, self._name,
+                        id=self._scope[1])
+
+class _TracedAsyncGenerator(object):
+  """Traces each step of an async generator as an async slice."""
+  def __init__(self, inner, category, name, args):
+    self._inner = inner
+    self._category = category
+    self._name = name
+    self._args = args
+
+  def _traced(self, awaitable):
+    return _TracedResumable(awaitable, self._category, self._name, self._args,
+                            True)
+
+  def __aiter__(self):
+    return self
+
+  def __anext__(self):
+    return self._traced(self._inner.__anext__())
+
+  def asend(self, value):
+    return self._traced(self._inner.asend(value))
+
+  def athrow(self, *exc_info):
+    return self._traced(self._inner.athrow(*exc_info))
+
+  def aclose(self):
+    return self._inner.aclose()
 
 def traced(*args):
   def get_wrapper(func):
-    if inspect.isgeneratorfunction(func):
-      raise Exception("Can not trace generators.")
-
     category = "python"
 
-    arg_spec = inspect.getargspec(func)
-    is_method = arg_spec.args and arg_spec.args[0] == "self"
+    spec_args, spec_defaults = _arg_spec(func)
+    is_method = spec_args and spec_args[0] == "self"
 
     def arg_spec_tuple(name):
-      arg_index = arg_spec.args.index(name)
-      defaults_length = len(arg_spec.defaults) if arg_spec.defaults else 0
-      default_index = arg_index + defaults_length - len(arg_spec.args)
+      arg_index = spec_args.index(name)
+      defaults_length = len(spec_defaults) if spec_defaults else 0
+      default_index = arg_index + defaults_length - len(spec_args)
       if default_index >= 0:
-        default = arg_spec.defaults[default_index]
+        default = spec_defaults[default_index]
       else:
         default = None
       return (name, arg_index, default)
 
-    args_to_log = map(arg_spec_tuple, arg_names)
+    args_to_log = list(map(arg_spec_tuple, arg_names))
+
+    flags = _code_flags(func)
+    is_generator = bool(flags & _CO_GENERATOR)
+    is_coroutine = bool(flags & _CO_COROUTINE)
+    is_async_generator = bool(flags & _CO_ASYNC_GENERATOR)
+    is_resumable = is_generator or is_coroutine or is_async_generator
+
+    func_name = func.__name__
+    plain_name = "%s.%s" % (func.__module__, func_name)
+
+    def get_name(args):
+      if is_method:
+        return "%s.%s" % (args[0].__class__.__name__, func_name)
+      return plain_name
 
     @functools.wraps(func)
     def traced_function(*args, **kwargs):
       # Everything outside traced_function is done at decoration-time.
       # Everything inside traced_function is done at run-time and must be fast.
       if not log._enabled:  # This check must be at run-time.
-        return func(*args, **kwargs)
+        triggers = not is_resumable and _latency_triggers.get(func_name)
+        trigger = triggers and triggers.get(get_name(args))
+        if not trigger:
+          return func(*args, **kwargs)
+        start = time.time()
+        try:
+          return func(*args, **kwargs)
+        finally:
+          trigger(start, time.time() - start)
 
       def get_arg_value(name, index, default):
         if name in kwargs:
@@ -57,23 +269,30 @@ def traced(*args):
         else:
           return default
 
-      if is_method:
-        name = "%s.%s" % (args[0].__class__.__name__, func.__name__)
-      else:
-        name = "%s.%s" % (func.__module__, func.__name__)
+      name = get_name(args)
 
       # Be sure to repr before calling func, because the argument values may change.
       arg_values = {
           name: repr(get_arg_value(name, index, default))
           for name, index, default in args_to_log}
 
-      start = time.time()
-      log.add_trace_event("B", start, category, name, arg_values)
+      if is_generator or is_coroutine:
+        return _TracedResumable(func(*args, **kwargs), category, name,
+                                arg_values, is_coroutine)
+      if is_async_generator:
+        return _TracedAsyncGenerator(func(*args, **kwargs), category, name,
+                                     arg_values)
+
+      scope = _begin(category, name, arg_values)
       try:
         return func(*args, **kwargs)
       finally:
-        end = time.time()
-        log.add_trace_event("E", end, category, name)
+        _end(category, name, scope)
+
+    if is_coroutine:
+      # Frameworks tell coroutine functions apart from functions returning
+      # awaitables, and asyncio.create_task only takes coroutines.
+      return functools.wraps(func)(_coroutine_function(traced_function))
     return traced_function
 
   no_decorator_arguments = len(args) == 1 and callable(args[0])
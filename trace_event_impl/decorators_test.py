@@ -1,13 +1,15 @@
 # Copyright 2011 The Chromium Authors. All rights reserved.
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
-import decorators
 import unittest
+from . import decorators
 from .trace_test import TraceTest
 
-def generator():
-  yield 1
-  yield 2
+try:
+  import asyncio
+  import contextvars
+except ImportError:
+  asyncio = None
 
 class DecoratorTests(unittest.TestCase):
   def test_tracing_object_fails(self):
@@ -15,9 +17,6 @@ class DecoratorTests(unittest.TestCase):
     self.assertRaises(Exception, lambda: decorators.trace(""))
     self.assertRaises(Exception, lambda: decorators.trace([]))
 
-  def test_tracing_generators_fail(self):
-    self.assertRaises(Exception, lambda: decorators.trace(generator))
-
 class ClassToTest(object):
   @decorators.traced
   def method1(self):
@@ -31,6 +30,13 @@ class ClassToTest(object):
 def traced_func():
   return 1
 
+@decorators.traced
+def traced_generator():
+  yield 1
+  decorators.log.trace_begin("inner")
+  decorators.log.trace_end("inner")
+  yield 2
+
 class DecoratorTests(TraceTest):
   def _get_decorated_method_name(self, f):
     res = self.go(f)
@@ -49,3 +55,106 @@ class DecoratorTests(TraceTest):
     ctt = ClassToTest()
     self.assertEquals('method1', self._get_decorated_method_name(ctt.method1))
     self.assertEquals('ClassToTest.method2', self._get_decorated_method_name(ctt.method2))
+
+class GeneratorTests(TraceTest):
+  def test_each_resume_is_traced(self):
+    values = []
+    res = self.go(lambda: values.extend(traced_generator()))
+    self.assertEquals([1, 2], values)
+    events = res.findEventsOnThread(res.findThreadIds()[0])
+    efmt = ["%s %s" % (e["ph"], e["name"].split(".")[-1]) for e in events]
+    self.assertEquals(
+      ["B traced_generator", "E traced_generator",
+       "B traced_generator", "B inner", "E inner", "E traced_generator",
+       "B traced_generator", "E traced_generator"],
+      efmt)
+
+  def test_send_and_throw(self):
+    @decorators.traced
+    def echo():
+      value = None
+      while True:
+        try:
+          value = yield value
+        except ValueError:
+          value = "caught"
+    def work():
+      g = echo()
+      next(g)
+      self.assertEquals(1, g.send(1))
+      self.assertEquals("caught", g.throw(ValueError))
+      g.close()
+    res = self.go(work)
+    self.assertEquals(6, len(res.findByPhase("B")) + len(res.findByPhase("E")))
+
+# Defined from a string so that this file still parses on Python 2.
+_ASYNC_SOURCE = """
+@decorators.traced
+async def leaf(delay):
+  with decorators.trace("in_leaf"):
+    await asyncio.sleep(delay)
+  return delay
+
+@decorators.traced
+async def request(delay):
+  return await leaf(delay)
+
+@decorators.traced
+async def counter(n):
+  for i in range(n):
+    await asyncio.sleep(0)
+    yield i
+
+async def interleaved():
+  return await asyncio.gather(request(0.02), request(0.01))
+
+async def consume():
+  return [i async for i in counter(3)]
+
+async def in_task(delay):
+  return await asyncio.create_task(request(delay))
+"""
+
+@unittest.skipIf(not asyncio, "requires asyncio and contextvars")
+class AsyncTests(TraceTest):
+  def setUp(self):
+    self.ns = {"asyncio": asyncio, "decorators": decorators}
+    exec(_ASYNC_SOURCE, self.ns)
+
+  def test_interleaved_coroutines(self):
+    results = []
+    res = self.go(lambda: results.append(asyncio.run(self.ns["interleaved"]())))
+    self.assertEquals([0.02, 0.01], results[0])
+    self.assertEquals(0, len(res.findByPhase("B")))
+    begins = res.findByPhase("b")
+    ids = set(e["id"] for e in begins)
+    self.assertEquals(2, len(ids))
+    for async_id in ids:
+      names = [e["name"].split(".")[-1] for e in begins if e["id"] == async_id]
+      self.assertEquals(["request", "leaf", "in_leaf"], names)
+    self.assertEquals(len(begins), len(res.findByPhase("e")))
+
+  def test_coroutine_function_stays_one(self):
+    import inspect
+    self.assertTrue(inspect.iscoroutinefunction(self.ns["request"]))
+    self.assertTrue(asyncio.iscoroutinefunction(self.ns["request"]))
+    results = []
+    res = self.go(lambda: results.append(
+        asyncio.run(self.ns["in_task"](0.01))))
+    self.assertEquals(0.01, results[0])
+    self.assertEquals(1, len([e for e in res.findByPhase("b")
+                              if e["name"].endswith("request")]))
+
+  def test_coroutine_duration(self):
+    res = self.go(lambda: asyncio.run(self.ns["request"](0.05)))
+    b = res.findByPhase("b")[0]
+    e = [x for x in res.findByPhase("e") if x["name"] == b["name"]][0]
+    self.assertTrue(e["ts"] - b["ts"] >= 50000)
+
+  def test_async_generator(self):
+    results = []
+    res = self.go(lambda: results.append(asyncio.run(self.ns["consume"]())))
+    self.assertEquals([0, 1, 2], results[0])
+    # One slice per step, including the final one that stops iteration.
+    self.assertEquals(4, len(res.findByPhase("b")))
+    self.assertEquals(4, len(res.findByPhase("e")))
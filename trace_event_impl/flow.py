@@ -0,0 +1,107 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import itertools
+import os
+import time
+
+from . import decorators
+from . import log
+
+try:
+  import concurrent.futures as futures
+except ImportError:
+  futures = None
+
+_flow_ids = itertools.count(1)
+
+def trace_flow_begin(name, flow_id=None):
+  """Starts a flow from the slice currently open on this thread.
+
+  Returns the flow's id. Pass it to trace_flow_step and trace_flow_end,
+  possibly on another thread or in another process, to link the slices
+  those calls are made from. Ids are unique across processes.
+  """
+  if flow_id == None:
+    flow_id = "%i:%i" % (os.getpid(), next(_flow_ids))
+  log.add_trace_event("s", time.time(), "python", name, id=flow_id)
+  return flow_id
+
+def trace_flow_step(name, flow_id):
+  log.add_trace_event("t", time.time(), "python", name, id=flow_id)
+
+def trace_flow_end(name, flow_id):
+  # Bind to the enclosing slice rather than to the next one that begins.
+  log.add_trace_event("f", time.time(), "python", name, id=flow_id, bp="e")
+
+def _callable_name(fn):
+  name = getattr(fn, "__name__", None)
+  if not name:
+    return repr(fn)
+  module = getattr(fn, "__module__", None)
+  if module:
+    return "%s.%s" % (module, name)
+  return name
+
+class _FlowCall(object):
+  """Calls fn in a slice that ends the flow started when this was created.
+
+  Must stay picklable so that it can be sent to other processes.
+  """
+  def __init__(self, fn, name, flow_id):
+    self.fn = fn
+    self.name = name
+    self.flow_id = flow_id
+
+  def __call__(self, *args, **kwargs):
+    with decorators.trace(self.name):
+      trace_flow_end(self.name, self.flow_id)
+      return self.fn(*args, **kwargs)
+
+class _ProcessFlowCall(_FlowCall):
+  """A _FlowCall for process pool workers.
+
+  Those are not shimmed processes: unless forked, they do not trace, and
+  they exit without flushing. So tracing is enabled with the settings of the
+  submitting process if needed, and the events are flushed after each call.
+  """
+  def __init__(self, fn, name, flow_id):
+    _FlowCall.__init__(self, fn, name, flow_id)
+    self.settings = (log._log_file_name() or log._sink, log._ring_buffer_size,
+                     log._max_file_size, log._max_file_age, log._keep_files)
+
+  def __call__(self, *args, **kwargs):
+    if not log._enabled and self.settings[0]:
+      log._trace_enable(*self.settings)
+    try:
+      return _FlowCall.__call__(self, *args, **kwargs)
+    finally:
+      log.trace_flush()
+
+def flow_wrap(fn):
+  """Wraps fn so that calling it is linked to the caller by a flow.
+
+  Use this when handing work to another thread or process by hand. Returns
+  fn unchanged when tracing is disabled.
+  """
+  return _flow_wrap(fn, _FlowCall)
+
+def _flow_wrap(fn, call_class):
+  if not log._enabled or isinstance(fn, _FlowCall):
+    return fn
+  name = _callable_name(fn)
+  return call_class(fn, name, trace_flow_begin(name))
+
+def _flow_submit(submit, call_class):
+  def flow_submit(self, fn, *args, **kwargs):
+    return submit(self, _flow_wrap(fn, call_class), *args, **kwargs)
+  flow_submit._flow_submit = True
+  return flow_submit
+
+# Monkeypatch the executors so that submitted work carries a flow along.
+if futures:
+  for _executor, _call_class in ((futures.ThreadPoolExecutor, _FlowCall),
+                                 (futures.ProcessPoolExecutor,
+                                  _ProcessFlowCall)):
+    if not hasattr(_executor.submit, "_flow_submit"):
+      _executor.submit = _flow_submit(_executor.submit, _call_class)
@@ -0,0 +1,103 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import unittest
+from .decorators import *
+from .flow import *
+from .log import *
+from .trace_test import *
+
+try:
+  import concurrent.futures as futures
+except ImportError:
+  futures = None
+
+def DoWork():
+  time.sleep(0.05)
+
+def Square(x):
+  return x * x
+
+class FlowTest(TraceTest):
+  def _assertLinked(self, res):
+    starts = res.findByPhase("s")
+    ends = res.findByPhase("f")
+    self.assertEquals(1, len(starts))
+    self.assertEquals(1, len(ends))
+    self.assertEquals(starts[0]["id"], ends[0]["id"])
+    self.assertEquals("e", ends[0]["bp"])
+    return starts[0], ends[0]
+
+  def test_flow_across_threads(self):
+    def work():
+      with trace("producer"):
+        flow_id = trace_flow_begin("job")
+      def consume():
+        with trace("consumer"):
+          trace_flow_end("job", flow_id)
+      t = threading.Thread(target=consume)
+      t.start()
+      t.join()
+    res = self.go(work)
+    s, f = self._assertLinked(res)
+    self.assertNotEquals(s["tid"], f["tid"])
+
+  def test_flow_wrap_is_noop_when_disabled(self):
+    self.assertTrue(flow_wrap(DoWork) is DoWork)
+
+  @unittest.skipIf(not futures, "requires concurrent.futures")
+  def test_thread_pool_executor(self):
+    def work():
+      with futures.ThreadPoolExecutor(1) as executor:
+        with trace("request"):
+          executor.submit(DoWork).result()
+    res = self.go(work)
+    s, f = self._assertLinked(res)
+    worker_slices = res.findByName("%s.DoWork" % __name__).findByPhase("B")
+    self.assertEquals(1, len(worker_slices))
+    self.assertEquals(f["tid"], worker_slices[0]["tid"])
+
+  def _process_pool_executor(self, start_method):
+    def work():
+      kwargs = {}
+      if start_method:
+        kwargs["mp_context"] = multiprocessing.get_context(start_method)
+      with futures.ProcessPoolExecutor(1, **kwargs) as executor:
+        with trace("request"):
+          executor.submit(DoWork).result()
+          self.assertEquals([0, 1, 4], list(executor.map(Square, range(3))))
+    res = self.go(work)
+    starts = res.findByPhase("s")
+    ends = res.findByPhase("f")
+    self.assertEquals(sorted([e["id"] for e in starts]),
+                      sorted([e["id"] for e in ends]))
+    self.assertTrue(len(starts) >= 2)
+    worker_slices = res.findByName("%s.DoWork" % __name__).findByPhase("B")
+    self.assertEquals(1, len(worker_slices))
+    self.assertNotEquals(os.getpid(), worker_slices[0]["pid"])
+    path = res.findCriticalPath("request")
+    self.assertTrue("%s.DoWork" % __name__ in [p["name"] for p in path])
+
+  @unittest.skipIf(not futures, "requires concurrent.futures")
+  def test_process_pool_executor(self):
+    self._process_pool_executor(None)
+
+  @unittest.skipIf(not futures or sys.version_info < (3, 7),
+                   "requires mp_context")
+  def test_process_pool_executor_spawn(self):
+    self._process_pool_executor("spawn")
+
+  def test_process_target(self):
+    def work():
+      with trace("request"):
+        p = multiprocessing.Process(target=DoWork)
+        p.start()
+        p.join()
+    res = self.go(work)
+    s, f = self._assertLinked(res)
+    self.assertNotEquals(s["pid"], f["pid"])
@@ -0,0 +1,53 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import gc
+import threading
+import time
+
+from . import log
+
+_enabled = False
+_tls = threading.local()
+
+def gc_tracing_enable():
+  """Records a "gc" slice for every garbage collection.
+
+  The slice is recorded on the thread that triggered the collection, so it
+  shows up inside the slices that the pause interrupted. Its args hold the
+  generation collected, the number of objects collected and the number of
+  uncollectable objects found.
+
+  Requires gc.callbacks, which is available from Python 3.3 on.
+  """
+  global _enabled
+  if not hasattr(gc, "callbacks"):
+    raise log.TraceException("gc.callbacks is not supported by this Python")
+  if _enabled:
+    raise log.TraceException("GC tracing already enabled")
+  _enabled = True
+  gc.callbacks.append(_gc_callback)
+
+def gc_tracing_disable():
+  global _enabled
+  if not _enabled:
+    return
+  _enabled = False
+  gc.callbacks.remove(_gc_callback)
+
+def gc_tracing_is_enabled():
+  return _enabled
+
+def _gc_callback(phase, info):
+  if phase == "start":
+    _tls.start = time.time()
+    return
+  start = getattr(_tls, "start", None)
+  _tls.start = None
+  if start == None or not log._enabled:
+    return
+  log.add_trace_event("X", start, "gc", "gc",
+                      {"generation": info["generation"],
+                       "collected": info["collected"],
+                       "uncollectable": info["uncollectable"]},
+                      dur=time.time() - start)
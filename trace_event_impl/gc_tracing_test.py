@@ -0,0 +1,45 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import gc
+import unittest
+from .gc_tracing import *
+from .log import *
+from .trace_test import *
+
+class Cycle(object):
+  def __init__(self):
+    self.me = self
+
+@unittest.skipIf(not hasattr(gc, "callbacks"), "requires gc.callbacks")
+class GCTracingTest(TraceTest):
+  def tearDown(self):
+    gc_tracing_disable()
+    TraceTest.tearDown(self)
+
+  def test_collection_is_traced(self):
+    def work():
+      gc_tracing_enable()
+      trace_begin("work")
+      for i in range(10):
+        Cycle()
+      gc.collect()
+      trace_end("work")
+    res = self.go(work)
+    work_events = res.findByName("work")
+    gc_events = [e for e in res.findByName("gc") if e["args"]["generation"] == 2]
+    self.assertTrue(len(gc_events) >= 1)
+    gc_event = gc_events[-1]
+    self.assertTrue(gc_event["args"]["collected"] >= 10)
+    self.assertEquals(work_events[0]["tid"], gc_event["tid"])
+    self.assertTrue(work_events[0]["ts"] <= gc_event["ts"])
+    self.assertTrue(gc_event["ts"] + gc_event["dur"] <= work_events[1]["ts"])
+
+  def test_enable_twice_fails(self):
+    gc_tracing_enable()
+    self.assertRaises(TraceException, gc_tracing_enable)
+
+@unittest.skipIf(hasattr(gc, "callbacks"), "gc.callbacks is supported")
+class GCTracingUnsupportedTest(unittest.TestCase):
+  def test_enable_fails(self):
+    self.assertRaises(TraceException, gc_tracing_enable)
@@ -0,0 +1,53 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Measures what importing trace_event costs a program that does not trace.
+
+Run as: python -m trace_event_impl.import_benchmark [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = [
+  "import trace_event",
+  "import trace_event_impl",
+  "from trace_event_impl import trace_begin, traced",
+  "import trace_event; trace_event.trace_enable(%r); trace_event.trace_disable()"
+  % os.devnull,
+]
+
+_CHILD = """
+import sys, time, json
+before = set(sys.modules)
+start = time.time()
+exec(%r)
+elapsed = time.time() - start
+print(json.dumps({"seconds": elapsed,
+                  "modules": sorted(set(sys.modules) - before)}))
+"""
+
+def run(statement, env=None):
+  """Runs statement in a fresh interpreter. Returns how long it took in
+  seconds, and the names of the modules it imported. Runs untraced unless
+  env says otherwise."""
+  if env == None:
+    env = dict(os.environ)
+    for variable in ("TRACE_EVENT_LOG_FILE", "TRACE_EVENT_STREAM"):
+      env.pop(variable, None)
+  output = subprocess.check_output(
+      [sys.executable, "-c", _CHILD % statement], cwd=_ROOT, env=env)
+  result = json.loads(output.decode("utf-8"))
+  return result["seconds"], result["modules"]
+
+def main(argv):
+  runs = int(argv[0]) if argv else 20
+  for statement in STATEMENTS:
+    times = sorted([run(statement)[0] for i in range(runs)])
+    print("%8.2f ms  %s" % (1000 * times[len(times) // 2], statement))
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,82 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from .import_benchmark import run
+from .parsed_trace_events import *
+
+# Only imported once tracing is enabled.
+_HEAVY_MODULES = ["inspect", "json", "multiprocessing", "socket"]
+
+class ImportCostTest(unittest.TestCase):
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self.log_file = os.path.join(self._dir, "trace.json")
+
+  def tearDown(self):
+    shutil.rmtree(self._dir)
+
+  def assertNotImported(self, names, statement):
+    modules = run(statement)[1]
+    for name in names:
+      self.assertFalse(name in modules, "%s imported %s" % (statement, name))
+
+  def test_import_trace_event(self):
+    self.assertNotImported(["trace_event_impl"] + _HEAVY_MODULES,
+                           "import trace_event")
+
+  @unittest.skipIf(sys.version_info < (3, 7),
+                   "trace_event_impl imports eagerly before Python 3.7")
+  def test_import_trace_event_impl(self):
+    self.assertNotImported(_HEAVY_MODULES, "import trace_event_impl")
+    self.assertNotImported(["multiprocessing", "socket"],
+                           "from trace_event_impl import trace_begin, traced")
+
+  def test_traced_before_enable(self):
+    statement = "\n".join([
+      "import trace_event",
+      "@trace_event.traced",
+      "def work():",
+      "  pass",
+      "work()",
+      "trace_event.trace_enable(%r)" % self.log_file,
+      "import multiprocessing",
+      "assert hasattr(multiprocessing.Process(), '_shimmed_by_trace_event')",
+      "work()",
+      "trace_event.trace_disable()"])
+    self.assertTrue("multiprocessing" in run(statement)[1])
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    self.assertEquals(2, len(res.findByName("__main__.work")))
+
+  def test_traced_with_arg_names(self):
+    statement = "\n".join([
+      "import trace_event",
+      "@trace_event.traced('url')",
+      "def send_request(url):",
+      "  return len(url)",
+      "assert send_request('a') == 1",
+      "trace_event.trace_enable(%r)" % self.log_file,
+      "assert send_request('bb') == 2",
+      "trace_event.trace_disable()"])
+    run(statement)
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    begin = res.findByName("__main__.send_request").findByPhase("B")
+    self.assertEquals(1, len(begin))
+    self.assertEquals({"url": repr("bb")}, begin[0]["args"])
+
+  def test_enabled_from_environment(self):
+    env = dict(os.environ)
+    env["TRACE_EVENT_LOG_FILE"] = self.log_file
+    statement = "\n".join([
+      "import trace_event",
+      "assert trace_event.trace_is_enabled()",
+      "trace_event.trace_begin('child')",
+      "trace_event.trace_end('child')"])
+    run(statement, env)
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    self.assertEquals(2, len(res.findByName("child")))
@@ -3,24 +3,69 @@
 # found in the LICENSE file.
 import atexit
 import fcntl
-import json
+import importlib
 import os
 import sys
 import time
 import threading
 
-_lock = threading.Lock()
+# Imported by _import_recording_modules when tracing is first enabled, so
+# that importing trace_event_impl stays cheap for programs that never trace.
+glob = None
+json = None
+re = None
+ring_buffer = None
+streaming = None
+
+# Modules that patch the standard library to trace across threads and
+# processes. Imported along with the above.
+_SHIMS = ("flow", "multiprocessing_shim", "subprocess_shim")
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
+# Re-entrant, since gc callbacks can record events from inside the lock.
+_lock = threading.RLock()
 
 _enabled = False
 _log_file = None
+_log_file_path = None # absolute, so that changing directories does not matter
 
 _cur_events = [] # events that have yet to be buffered
 
+# In ring buffer mode, events are recorded into a crash-surviving per-process
+# ring buffer instead of _cur_events.
+_ring_buffer = None
+_ring_buffer_size = None
+_ring_buffer_pid = None
+
+# When tracing into a streaming.StreamSink, events are handed to it as they
+# are recorded, and there is no log file.
+_sink = None
+
+# Rotation settings, see trace_enable. _log_file_created is when the current
+# log file was started, by whichever process started it.
+_max_file_size = None
+_max_file_age = None
+_keep_files = None
+_log_file_created = None
+
+# The name of the event _rotate writes last to a rotated file, before the
+# trailing ]. Processes sharing the file look for it to learn that they have
+# to switch to the new file.
+_ROTATED_EVENT_NAME = "trace_event_rotated"
+
 _tls = threading.local() # tls used to detect forking/etc
 _atexit_regsitered_for_pid = None
 
 _control_allowed = True
 
+# Set when tracing was enabled because the parent process asked for it
+# through the environment. An explicit trace_enable overrides that.
+_enabled_from_environment = False
+
 class TraceException(Exception):
   pass
 
@@ -43,33 +88,91 @@ def _disallow_tracing_control():
   global _control_allowed
   _control_allowed = False
 
-def trace_enable(log_file=None):
-  _trace_enable(log_file)
-  
+def trace_enable(log_file=None, ring_buffer_size=None, max_file_size=None,
+                 max_file_age=None, keep_files=None):
+  if not _control_allowed:
+    raise TraceException("Tracing control not allowed in child processes.")
+  if _enabled_from_environment:
+    _trace_disable()
+  _trace_enable(log_file, ring_buffer_size, max_file_size, max_file_age,
+                keep_files)
+
 @_locked
-def _trace_enable(log_file=None):
+def _trace_enable(log_file=None, ring_buffer_size=None, max_file_size=None,
+                  max_file_age=None, keep_files=None):
   global _enabled
   if _enabled:
     raise TraceException("Already enabled")
-  if not _control_allowed:
-    raise TraceException("Tracing control not allowed in child processes.")
-  _enabled = True
-  global _log_file
+  _import_recording_modules()
+  if ring_buffer_size and not (isinstance(log_file, basestring) or
+                               log_file == None):
+    raise TraceException("Ring buffers require the log file to be given by name")
+  if (max_file_size or max_file_age) and not (isinstance(log_file, basestring) or
+                                              log_file == None):
+    raise TraceException("Rotation requires the log file to be given by name")
+  if isinstance(log_file, streaming.StreamSink):
+    _enable_sink(log_file)
+    return
+  global _log_file, _log_file_path
   if log_file == None:
-    if sys.argv[0] == '':
-      n = 'trace_event'
-    else:
-      n = sys.argv[0]
-    log_file = open("%s.json" % n, "ab", False)
-    _note("trace_event: tracelog name is %s.json" % n)
-  elif isinstance(log_file, basestring):
+    log_file = _default_log_file_name()
+  if isinstance(log_file, basestring):
     _note("trace_event: tracelog name is %s" % log_file)
-    log_file = open("%s" % log_file, "ab", False)
+    _log_file_path = os.path.abspath(log_file)
+    # Readable, so that _was_rotated can look at its end.
+    log_file = open(_log_file_path, "a+")
   elif not hasattr(log_file, 'fileno'):
     raise TraceException("Log file must be None, a string, or a file-like object with a fileno()")
+  else:
+    name = getattr(log_file, "name", None)
+    _log_file_path = None
+    if isinstance(name, basestring) and not name.startswith("<"):
+      _log_file_path = os.path.abspath(name)
 
   _log_file = log_file
   fcntl.lockf(_log_file.fileno(), fcntl.LOCK_EX)
+  _start_log_file()
+  _log_file.flush()
+  fcntl.lockf(_log_file.fileno(), fcntl.LOCK_UN)
+
+  global _ring_buffer_size, _max_file_size, _max_file_age, _keep_files
+  _max_file_size = max_file_size
+  _max_file_age = max_file_age
+  _keep_files = keep_files
+  _ring_buffer_size = ring_buffer_size
+  if _ring_buffer_size:
+    _open_ring_buffer()
+  _enabled = True
+
+def _import_recording_modules():
+  global glob, json, re, ring_buffer, streaming
+  if streaming:
+    return
+  import glob
+  import json
+  import re
+  from . import ring_buffer
+  for name in _SHIMS:
+    importlib.import_module(".%s" % name, __package__)
+  # Last, since it tells that all of them were imported.
+  from . import streaming
+
+def _enable_sink(sink):
+  global _enabled, _sink, _log_file_path
+  _log_file_path = None
+  global _ring_buffer_size, _max_file_size, _max_file_age, _keep_files
+  _ring_buffer_size = _max_file_size = _max_file_age = _keep_files = None
+  _sink = sink
+  _sink.start()
+  _sink.put({"ph": "M", "category": "process_argv",
+             "pid": os.getpid(), "tid": threading.current_thread().ident,
+             "ts": time.time(),
+             "name": "process_argv", "args": {"argv": sys.argv}})
+  _enabled = True
+
+def _start_log_file():
+  """Writes the header if the log file is new. Requires the file lock."""
+  global _log_file_created
   _log_file.seek(0, os.SEEK_END)
 
   lastpos = _log_file.tell()
@@ -86,34 +189,161 @@ def _trace_enable(log_file=None):
          "ts": time.time(),
          "name": "process_argv", "args": {"argv": sys.argv}}
     _log_file.write("%s\n" % json.dumps(x))
+    _log_file_created = x["ts"]
   else:
     _note("trace_event: Opened existing tracelog")
-  _log_file.flush()
+    _log_file_created = _read_log_file_created()
+
+def _read_log_file_created():
+  # The header written by the process that started the log file says when.
+  try:
+    with open(_log_file_name()) as f:
+      return float(json.loads(f.readline()[1:])["ts"])
+  except (EnvironmentError, TypeError, ValueError, KeyError):
+    return time.time()
+
+def _was_rotated():
+  """Returns whether the log file ends with what _rotate writes last.
+  Requires the file lock."""
+  fd = _log_file.fileno()
+  try:
+    size = os.fstat(fd).st_size
+    os.lseek(fd, max(0, size - 512), os.SEEK_SET)
+    tail = os.read(fd, 512)
+  except OSError:
+    return False # e.g. a write-only file object
+  return (tail.endswith(b"\n]\n") and
+          _ROTATED_EVENT_NAME.encode("utf-8") in tail)
+
+def _follow_rotation():
+  """Switches to a new file at the log file's path if this or another
+  process rotated ours away. Requires the file lock.
+
+  Rotation renames the log file and marks it while holding its lock, so
+  once we hold the lock, our file is either still current or marked.
+  """
+  global _log_file
+  if not _log_file_path or not _was_rotated():
+    return
+  _note("trace_event: %s was rotated" % _log_file_path)
   fcntl.lockf(_log_file.fileno(), fcntl.LOCK_UN)
+  _log_file.close()
+  _log_file = open(_log_file_path, "a+")
+  fcntl.lockf(_log_file.fileno(), fcntl.LOCK_EX)
+  _start_log_file()
+
+def _rotated_log_files(name):
+  """Returns (index, path) of the files rotated away from name, oldest first."""
+  root, ext = os.path.splitext(name)
+  escape = getattr(glob, "escape", lambda s: s)
+  pattern = re.compile(r"\.(\d+)%s$" % re.escape(ext))
+  rotated = []
+  for path in glob.glob("%s.*%s" % (escape(root), escape(ext))):
+    m = pattern.search(path)
+    if m and path[:m.start()] == root:
+      rotated.append((int(m.group(1)), path))
+  return sorted(rotated)
+
+def _should_rotate():
+  if _max_file_size and _log_file.tell() >= _max_file_size:
+    return True
+  return bool(_max_file_age and time.time() - _log_file_created >= _max_file_age)
+
+def _rotate():
+  """Renames the log file to the next free "<root>.<n><ext>" name, and
+  closes it with a _ROTATED_EVENT_NAME event and a trailing ]. Requires the
+  file lock."""
+  name = _log_file_name()
+  root, ext = os.path.splitext(name)
+  rotated = _rotated_log_files(name)
+  index = rotated[-1][0] + 1 if rotated else 1
+  path = "%s.%i%s" % (root, index, ext)
+  os.rename(name, path)
+  x = {"ph": "M", "category": "trace_event",
+       "pid": os.getpid(), "tid": threading.current_thread().ident,
+       "ts": 1000000 * time.time(),
+       "name": _ROTATED_EVENT_NAME, "args": {"path": path}}
+  _log_file.write(",\n%s\n]\n" % json.dumps(x))
+  _note("trace_event: Rotated %s to %s" % (name, path))
+  if _keep_files != None:
+    for i, old_path in rotated[:max(0, len(rotated) + 1 - _keep_files)]:
+      try:
+        os.unlink(old_path)
+      except OSError:
+        pass
+
+def _open_ring_buffer():
+  global _ring_buffer, _ring_buffer_pid
+  if _ring_buffer:
+    _ring_buffer.close()
+  _ring_buffer_pid = os.getpid()
+  path = ring_buffer.ring_buffer_path(_log_file_name(), _ring_buffer_pid)
+  _ring_buffer = ring_buffer.RingBuffer(path, _ring_buffer_size)
+  _note("trace_event: Recording into ring buffer %s" % path)
+
+def _default_log_file_name():
+  if sys.argv[0] == '':
+    return 'trace_event.json'
+  return '%s.json' % sys.argv[0]
+
+def _log_file_name():
+  """Returns the absolute path of the log file if it can be reopened by
+  name."""
+  return _log_file_path
 
 @_locked
 def trace_flush():
   if _enabled:
     _flush()
 
-@_locked
 def trace_disable():
-  global _enabled
   if not _control_allowed:
     raise TraceException("Tracing control not allowed in child processes.")
+  _trace_disable()
+
+@_locked
+def _trace_disable():
+  global _enabled, _enabled_from_environment
   if not _enabled:
     return
   _enabled = False
+  _enabled_from_environment = False
+  name = _log_file_name()
   _flush(close=True)
+  if _ring_buffer_size:
+    # Pick up what crashed or killed processes left behind.
+    ring_buffer.recover_ring_buffers(name)
 
 def _flush(close=False):
-  global _log_file
+  global _log_file, _log_file_path, _ring_buffer, _sink
+  if _sink:
+    # A forked child that recorded nothing still has its parent's sink.
+    if _sink.pid == os.getpid():
+      if close:
+        _sink.close()
+      else:
+        _sink.flush()
+    if close:
+      _sink = None
+    return
   fcntl.lockf(_log_file.fileno(), fcntl.LOCK_EX)
+  _follow_rotation()
   _log_file.seek(0, os.SEEK_END)
-  if len(_cur_events):
+  # Events may be added re-entrantly while we write, so only remove the ones
+  # that were written.
+  events = _cur_events[:]
+  records = [json.dumps(e) for e in events]
+  if _ring_buffer and _ring_buffer_pid != os.getpid():
+    # We forked. The ring buffer we have is the parent's.
+    _open_ring_buffer()
+  if _ring_buffer:
+    records.extend([r.decode("utf-8") for r in _ring_buffer.consume()])
+  if len(records):
     _log_file.write(",\n")
-    _log_file.write(",\n".join([json.dumps(e) for e in _cur_events]))
-    del _cur_events[:]
+    _log_file.write(",\n".join(records))
+    del _cur_events[:len(events)]
+    if (_max_file_size or _max_file_age) and _should_rotate():
+      _rotate()
 
   if close:
     # We might not be the only process writing to this logfile. So,
@@ -128,6 +358,10 @@ def _flush(close=False):
     _note("trace_event: Closed")
     _log_file.close()
     _log_file = None
+    _log_file_path = None
+    if _ring_buffer:
+      _ring_buffer.close(unlink=True)
+      _ring_buffer = None
   else:
     _note("trace_event: Flushed")
 
@@ -135,30 +369,58 @@ def _flush(close=False):
 def trace_is_enabled():
   return _enabled
 
-@_locked
-def add_trace_event(ph, ts, category, name, args=None):
-  global _enabled
-  if not _enabled:
+def add_trace_event(ph, ts, category, name, args=None, dur=None, tid=None,
+                    id=None, bp=None):
+  global _enabled, _sink
+  # The sink's sender thread holds the sink's lock, which put() takes while
+  # _lock is held, so it must not record, e.g. from a gc callback.
+  sink = _sink
+  if sink and threading.current_thread() is sink._thread:
     return
-  if not hasattr(_tls, 'pid') or _tls.pid != os.getpid():
-    _tls.pid = os.getpid()
-    global _atexit_regsitered_for_pid
-    if _tls.pid != _atexit_regsitered_for_pid:
-      _atexit_regsitered_for_pid = _tls.pid
-      atexit.register(_trace_disable_atexit)
-      _tls.pid = os.getpid()
-      del _cur_events[:] # we forked, clear the event buffer!
-    tid = threading.current_thread().ident
-    if not tid:
-      tid = os.getpid()
-    _tls.tid = tid
+  with _lock:
+    if not _enabled:
+      return
+    if not hasattr(_tls, 'pid') or _tls.pid != os.getpid():
+      pid = os.getpid()
+      global _atexit_regsitered_for_pid
+      if pid != _atexit_regsitered_for_pid:
+        _atexit_regsitered_for_pid = pid
+        atexit.register(_trace_disable_atexit)
+        del _cur_events[:] # we forked, clear the event buffer!
+        if _ring_buffer and _ring_buffer_pid != pid:
+          _open_ring_buffer()
+        if _sink and _sink.pid != pid:
+          # The parent's sender thread did not survive the fork.
+          _sink = _sink.copy()
+          _sink.start()
+      thread_id = threading.current_thread().ident
+      if not thread_id:
+        thread_id = pid
+      _tls.tid = thread_id
+      # Set last: events recorded re-entrantly from here on (e.g. by a gc
+      # callback) skip this block and rely on _tls.tid.
+      _tls.pid = pid
 
-  if ts:
-    ts = 1000000 * ts
-  _cur_events.append({"ph": ph, "category": category,
-                      "pid": _tls.pid, "tid": _tls.tid,
-                      "ts": ts,
-                      "name": name, "args": args or {}});
+    if ts:
+      ts = 1000000 * ts
+    if tid == None:
+      tid = _tls.tid
+    event = {"ph": ph, "category": category,
+             "pid": _tls.pid, "tid": tid,
+             "ts": ts,
+             "name": name, "args": args or {}}
+    if dur != None:
+      event["dur"] = 1000000 * dur
+    if id != None:
+      event["id"] = id
+    if bp != None:
+      event["bp"] = bp
+    if _ring_buffer:
+      _ring_buffer.append(json.dumps(event).encode("utf-8"))
+    elif _sink:
+      _sink.put(event)
+    else:
+      _cur_events.append(event)
 
 def trace_begin(name, args=None):
   add_trace_event("B", time.time(), "python", name, args)
@@ -166,5 +428,8 @@ def trace_begin(name, args=None):
 def trace_end(name, args=None):
   add_trace_event("E", time.time(), "python", name, args)
 
+def trace_counter(name, **values):
+  add_trace_event("C", time.time(), "python", name, values)
+
 def _trace_disable_atexit():
-  trace_disable()
+  _trace_disable()
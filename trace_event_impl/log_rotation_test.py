@@ -0,0 +1,133 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from .log import *
+from .parsed_trace_events import *
+
+def FlushTwice():
+  trace_begin("child1")
+  trace_end("child1")
+  trace_flush()
+  time.sleep(0.3)
+  trace_begin("child2")
+  trace_end("child2")
+  trace_flush()
+
+class LogRotationTest(unittest.TestCase):
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self.log_file = os.path.join(self._dir, "trace.json")
+
+  def tearDown(self):
+    if trace_is_enabled():
+      trace_disable()
+    shutil.rmtree(self._dir)
+
+  def rotated(self, i):
+    return os.path.join(self._dir, "trace.%i.json" % i)
+
+  def load(self, path):
+    with open(path) as f:
+      self.assertTrue(f.read().rstrip().endswith("]"))
+    return ParsedTraceEvents(trace_filename=path)
+
+  def test_size_rotation(self):
+    trace_enable(self.log_file, max_file_size=1000)
+    for i in range(20):
+      trace_begin("work", {"i": i})
+      trace_end("work")
+      trace_flush()
+    trace_disable()
+    names = sorted(os.listdir(self._dir))
+    self.assertTrue(len(names) > 2)
+    count = len(ParsedTraceEvents(trace_filename=self.log_file).findByName("work"))
+    for i in range(1, len(names)):
+      res = self.load(self.rotated(i))
+      self.assertEquals("process_argv", res.events[0]["name"])
+      count += len(res.findByName("work"))
+    self.assertEquals(40, count)
+
+  def test_keep_files(self):
+    trace_enable(self.log_file, max_file_size=1, keep_files=2)
+    for i in range(5):
+      trace_begin("work")
+      trace_end("work")
+      trace_flush()
+    trace_disable()
+    self.assertEquals(["trace.4.json", "trace.5.json", "trace.json"],
+                      sorted(os.listdir(self._dir)))
+
+  def test_age_rotation_across_processes(self):
+    trace_enable(self.log_file, max_file_age=0.2)
+    p = multiprocessing.Process(target=FlushTwice)
+    p.start()
+    p.join()
+    trace_begin("parent")
+    trace_end("parent")
+    trace_disable()
+    res = self.load(self.rotated(1))
+    self.assertEquals(2, len(res.findByName("child1")))
+    self.assertEquals(2, len(res.findByName("child2")))
+    self.assertEquals(0, len(res.findByName("parent")))
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    self.assertEquals(2, len(res.findByName("parent")))
+    self.assertFalse(os.path.exists(self.rotated(2)))
+
+  def test_relative_name_survives_chdir(self):
+    cwd = os.getcwd()
+    other = os.path.join(self._dir, "other")
+    os.mkdir(other)
+    os.chdir(self._dir)
+    try:
+      trace_enable("trace.json")
+      os.chdir(other)
+      trace_begin("work")
+      trace_end("work")
+      trace_flush()
+      trace_disable()
+    finally:
+      os.chdir(cwd)
+    self.assertEquals([], os.listdir(other))
+    res = ParsedTraceEvents(trace_filename=self.log_file)
+    self.assertEquals(2, len(res.findByName("work")))
+
+  def test_rotation_after_chdir(self):
+    cwd = os.getcwd()
+    os.chdir(self._dir)
+    try:
+      trace_enable("trace.json", max_file_size=1)
+      os.chdir(cwd)
+      for i in range(2):
+        trace_begin("work")
+        trace_end("work")
+        trace_flush()
+      trace_disable()
+    finally:
+      os.chdir(cwd)
+    self.assertEquals(["trace.1.json", "trace.2.json", "trace.json"],
+                      sorted(os.listdir(self._dir)))
+    self.assertEquals(2, len(self.load(self.rotated(2)).findByName("work")))
+
+  def test_file_object_survives_rename(self):
+    f = open(self.log_file, "a")
+    trace_enable(f)
+    os.rename(self.log_file, self.rotated(1))
+    trace_begin("work")
+    trace_end("work")
+    trace_disable()
+    self.assertFalse(os.path.exists(self.log_file))
+    res = ParsedTraceEvents(trace_filename=self.rotated(1))
+    self.assertEquals(2, len(res.findByName("work")))
+
+  def test_rotation_requires_file_name(self):
+    f = tempfile.NamedTemporaryFile()
+    self.assertRaises(TraceException,
+                      lambda: trace_enable(f, max_file_size=1000))
+    f.close()
@@ -2,29 +2,92 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 import multiprocessing
-import log
-import time
+import multiprocessing.pool
+import threading
+from . import control
+from . import flow
+from . import log
 
 _RealProcess = multiprocessing.Process
 
+# How long terminate() waits for the child to confirm it flushed.
+_FLUSH_TIMEOUT = 1.0
+
 __all__ = []
 
+def _flush_when_requested(flush_requested, flushed):
+  flush_requested.acquire()
+  if log.trace_is_enabled():
+    log.trace_flush()
+  flushed.release()
+
 class ProcessSubclass(_RealProcess):
   def __init__(self, shim, *args, **kwards):
     _RealProcess.__init__(self, *args, **kwards)
     self._shim = shim
+    self._start_method = None
+    self._trace_log_file = None
+    self._trace_ring_buffer_size = None
+    self._trace_rotation = None
+    self._tracing_control = None
+    self._flush_requested = None
+    self._flushed = None
+
+  def _context(self):
+    if hasattr(multiprocessing, "get_context"):
+      return multiprocessing.get_context(self._start_method)
+    return multiprocessing
+
+  if hasattr(multiprocessing, "get_context"):
+    def _Popen(self, process_obj):
+      # Honor the start method of the context the process was created for.
+      return self._context().Process._Popen(process_obj)
+
+  def start(self):
+    self._tracing_control = control._current_settings()
+    if log.trace_is_enabled():
+      # Children started with spawn or forkserver do not inherit tracing, so
+      # they reopen the log file by name.
+      self._trace_log_file = log._log_file_name() or log._sink
+      self._trace_ring_buffer_size = log._ring_buffer_size
+      self._trace_rotation = (log._max_file_size, log._max_file_age,
+                              log._keep_files)
+      # Semaphores rather than Events: setting an Event blocks until its
+      # waiters wake up, which never happens if the child already died.
+      self._flush_requested = self._context().Semaphore(0)
+      self._flushed = self._context().Semaphore(0)
+    _RealProcess.start(self)
 
   def run(self,*args,**kwargs):
+    if self._trace_log_file and not log.trace_is_enabled():
+      log.trace_enable(self._trace_log_file, self._trace_ring_buffer_size,
+                       *self._trace_rotation)
     log._disallow_tracing_control()
+    control._restore(self._tracing_control)
+    if self._flush_requested:
+      t = threading.Thread(target=_flush_when_requested,
+                           args=(self._flush_requested, self._flushed))
+      t.daemon = True
+      t.start()
     try:
       r = _RealProcess.run(self, *args, **kwargs)
     finally:
       if log.trace_is_enabled():
-        log.trace_flush() # todo, reduce need for this...
+        log.trace_flush()
     return r
 
+  def flush_trace(self, timeout=_FLUSH_TIMEOUT):
+    """Asks the running child to flush its trace events and waits until it
+    did, or until timeout seconds passed. Returns whether it did."""
+    if not self._flush_requested or not self.is_alive():
+      return False
+    self._flush_requested.release()
+    return self._flushed.acquire(True, timeout)
+
 class ProcessShim():
   def __init__(self, group=None, target=None, name=None, args=(), kwargs={}):
+    if target:
+      target = flow.flow_wrap(target)
     self._proc = ProcessSubclass(self, group, target, name, args, kwargs)
     # hint to testing code that the shimming worked
     self._shimmed_by_trace_event = True
@@ -36,8 +99,7 @@ class ProcessShim():
     self._proc.start()
 
   def terminate(self):
-    if log.trace_is_enabled():
-      time.sleep(0.25) # give the flush a chance to finish --> ergh, find some other way
+    self._proc.flush_trace()
     self._proc.terminate()
 
   def join(self, timeout=None):
@@ -82,9 +144,24 @@ class ProcessShim():
   def pid(self):
     return self._proc.pid
 
+  @property
+  def sentinel(self):
+    return self._proc.sentinel
+
   def __repr__(self):
     return self._proc.__repr__()
 
+def _pool_process(ctx, *args, **kwargs):
+  shim = ProcessShim(*args, **kwargs)
+  shim._proc._start_method = ctx.get_start_method()
+  return shim
+
 # Monkeypatch in our process replacement.
 if multiprocessing.Process != ProcessShim:
   multiprocessing.Process = ProcessShim
+
+# Pool looks up its process class on itself. Python 3 passes it a context.
+if isinstance(multiprocessing.pool.Pool.__dict__["Process"], staticmethod):
+  multiprocessing.pool.Pool.Process = staticmethod(_pool_process)
+else:
+  multiprocessing.pool.Pool.Process = ProcessShim
@@ -2,6 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 import multiprocessing
+import sys
 import tempfile
 import time
 import unittest
@@ -32,10 +33,17 @@ def AssertTracingDisabled():
 def TryToDisableTracing():
   trace_disable();
 
+def DoWorkThenHang():
+  DoWork()
+  while True:
+    time.sleep(1)
+
 class MultiprocessingShimTest(TraceTest):
   def test_shimmed(self):
-    p = multiprocessing.Process()
-    self.assertTrue(hasattr(p, "_shimmed_by_trace_event"))
+    def work():
+      p = multiprocessing.Process()
+      self.assertTrue(hasattr(p, "_shimmed_by_trace_event"))
+    self.go(work)
 
   def test_trace_enable_throws_in_child(self):
     def work():
@@ -74,3 +82,38 @@ class MultiprocessingShimTest(TraceTest):
     self.assertEquals(2, len(work_events))
     self.assertEquals(2, len(do_work_events))
 
+
+  def test_terminate_flushes_busy_child(self):
+    def work():
+      p = multiprocessing.Process(target=DoWorkThenHang)
+      p.start()
+      time.sleep(0.5)
+      start = time.time()
+      p.terminate()
+      p.join()
+      self.assertTrue(time.time() - start < 0.25)
+    res = self.go(work)
+    self.assertEquals(2, len(res.findByName('do_work')))
+
+  def test_pool_terminate_flushes_busy_workers(self):
+    def work():
+      p = multiprocessing.Pool(2)
+      for i in range(2):
+        p.apply_async(DoWorkThenHang, ())
+      time.sleep(0.5)
+      p.terminate()
+      p.join()
+    res = self.go(work)
+    self.assertEquals(4, len(res.findByName('do_work')))
+
+  @unittest.skipIf(sys.version_info < (3, 4), "requires start methods")
+  def test_spawned_pool_worker(self):
+    def work():
+      p = multiprocessing.get_context("spawn").Pool(1)
+      p.apply(AssertTracingEnabled, ())
+      p.apply(DoWork, ())
+      p.close()
+      p.terminate()
+      p.join()
+    res = self.go(work)
+    self.assertEquals(2, len(res.findByName('do_work')))
@@ -1,9 +1,35 @@
 # Copyright 2011 The Chromium Authors. All rights reserved.
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
+import bisect
 import math
 import json
 
+class _Slice(object):
+  def __init__(self, name, pid, tid, start, end, args=None, category=None):
+    self.name = name
+    self.category = category
+    self.pid = pid
+    self.tid = tid
+    self.start = start
+    self.end = end
+    self.args = args or {}
+    self.id = None # of async slices
+    self.parent = None
+    self.children = []
+    self.flow_targets = [] # slices that flows started in this slice lead to
+
+  def dependencies(self):
+    """Slices this one may have waited for: its children, and the targets of
+    flows started by it or its descendants."""
+    deps = list(self.children)
+    pending = [self]
+    while pending:
+      s = pending.pop()
+      deps.extend(s.flow_targets)
+      pending.extend(s.children)
+    return deps
+
 class ParsedTraceEvents(object):
   def __init__(self, events = None, trace_filename = None):
     """
@@ -46,10 +72,12 @@ class ParsedTraceEvents(object):
         events = events['traceEvents']
 
     if not hasattr(events, '__iter__'):
-      raise Exception, 'events must be iteraable.'
+      raise Exception('events must be iteraable.')
     self.events = events
     self.pids = None
     self.tids = None
+    self.slices = None
+    self.async_slices = None
 
   def __len__(self):
     return len(self.events)
@@ -94,3 +122,345 @@ class ParsedTraceEvents(object):
 
   def findByName(self, n):
     return ParsedTraceEvents([e for e in self.events if e["name"] == n])
+
+  def findSlices(self):
+    """
+    Pairs up B/E events and X events into slices, nested per thread, and
+    links them along flow events. Times are in the trace's microseconds.
+    Slices that did not end last until the end of the trace, with a
+    "did_not_finish" arg.
+    """
+    if self.slices != None:
+      return self.slices
+    slices_by_thread = {}
+    open_slices = {}
+    events = sorted([e for e in self.events if e["ph"] in "BEX"],
+                    key=lambda e: e["ts"])
+    for e in events:
+      key = (e.get("pid"), e.get("tid"))
+      thread_slices = slices_by_thread.setdefault(key, [])
+      if e["ph"] == "X":
+        thread_slices.append(
+            _Slice(e["name"], key[0], key[1], e["ts"], e["ts"] + e["dur"],
+                   e.get("args"), e.get("category")))
+      elif e["ph"] == "B":
+        open_slices.setdefault(key, []).append(e)
+      elif open_slices.get(key):
+        b = open_slices[key].pop()
+        # Like the viewer, merge the args of both ends.
+        args = dict(b.get("args") or {})
+        args.update(e.get("args") or {})
+        thread_slices.append(
+            _Slice(b["name"], key[0], key[1], b["ts"], e["ts"], args,
+                   b.get("category")))
+
+    # Like the viewer, end the slices that did not finish, e.g. because the
+    # process was still running or was killed, where the trace ends.
+    for key, stack in open_slices.items():
+      for b in stack:
+        args = dict(b.get("args") or {})
+        args["did_not_finish"] = True
+        slices_by_thread[key].append(
+            _Slice(b["name"], key[0], key[1], b["ts"], self._end(), args,
+                   b.get("category")))
+    self._nest(slices_by_thread)
+
+    flows = {}
+    for e in self.events:
+      if e["ph"] in "stf" and "id" in e:
+        flows.setdefault(e["id"], []).append(e)
+    starts_by_thread = {}
+    for key, thread_slices in slices_by_thread.items():
+      starts_by_thread[key] = [s.start for s in thread_slices]
+    for flow in flows.values():
+      flow.sort(key=lambda e: e["ts"])
+      bound = [self._bindFlowEvent(slices_by_thread, starts_by_thread, e)
+               for e in flow]
+      for src, dst in zip(bound, bound[1:]):
+        if src and dst and src is not dst:
+          src.flow_targets.append(dst)
+
+    self.slices = []
+    for thread_slices in slices_by_thread.values():
+      self.slices.extend(thread_slices)
+    return self.slices
+
+  def _findAsyncSlices(self):
+    """
+    Pairs up b/e events into slices, nested per process and async id, like
+    findSlices does for threads.
+    """
+    if self.async_slices != None:
+      return self.async_slices
+    slices_by_id = {}
+    open_slices = {}
+    events = sorted([e for e in self.events if e["ph"] in "be"],
+                    key=lambda e: e["ts"])
+    for e in events:
+      key = (e.get("pid"), e.get("id"))
+      name_key = (key, e.get("category"), e["name"])
+      id_slices = slices_by_id.setdefault(key, [])
+      if e["ph"] == "b":
+        open_slices.setdefault(name_key, []).append(e)
+      elif open_slices.get(name_key):
+        b = open_slices[name_key].pop()
+        args = dict(b.get("args") or {})
+        args.update(e.get("args") or {})
+        id_slices.append(self._asyncSlice(b, e["ts"], args))
+    for name_key, stack in open_slices.items():
+      for b in stack:
+        args = dict(b.get("args") or {})
+        args["did_not_finish"] = True
+        slices_by_id[name_key[0]].append(self._asyncSlice(b, self._end(), args))
+    self._nest(slices_by_id)
+    self.async_slices = []
+    for id_slices in slices_by_id.values():
+      self.async_slices.extend(id_slices)
+    return self.async_slices
+
+  def _asyncSlice(self, b, end, args):
+    s = _Slice(b["name"], b.get("pid"), b.get("tid"), b["ts"], end, args,
+               b.get("category"))
+    s.id = b.get("id")
+    return s
+
+  def _end(self):
+    """Returns when the last event of the trace ends."""
+    return max([e["ts"] + e.get("dur", 0) for e in self.events
+                if e["ph"] != "M" and "ts" in e])
+
+  def _nest(self, slices_by_track):
+    for track_slices in slices_by_track.values():
+      track_slices.sort(key=lambda s: (s.start, -s.end))
+      stack = []
+      for s in track_slices:
+        while stack and stack[-1].end < s.end:
+          stack.pop()
+        if stack:
+          s.parent = stack[-1]
+          stack[-1].children.append(s)
+        stack.append(s)
+
+  def _bindFlowEvent(self, slices_by_thread, starts_by_thread, e):
+    key = (e.get("pid"), e.get("tid"))
+    thread_slices = slices_by_thread.get(key, [])
+    starts = starts_by_thread.get(key, [])
+    if e["ph"] == "f" and e.get("bp") != "e":
+      # Binds to the next slice that begins.
+      i = bisect.bisect_left(starts, e["ts"])
+      if i < len(thread_slices):
+        return thread_slices[i]
+      return None
+    # Binds to the innermost enclosing slice: that is the last slice to start
+    # before the event, or one of its ancestors.
+    i = bisect.bisect_right(starts, e["ts"]) - 1
+    s = thread_slices[i] if i >= 0 else None
+    while s and s.end < e["ts"]:
+      s = s.parent
+    return s
+
+  def findAllocationHotspots(self, key="net_alloc_bytes"):
+    """
+    Ranks scopes by the memory they allocated, as recorded by
+    alloc_tracing_enable. key is "net_alloc_bytes", "net_alloc_blocks" or
+    "alloc_peak_bytes".
+
+    Returns a list of dicts, one per slice name, with the number of slices
+    of that name that recorded key as "count", the sum of key over them as
+    "total", and that sum less what their children recorded as "self". For
+    peaks, which do not add up, only the largest peak of the children of
+    each slice is taken off. Sorted by decreasing "self", so the scopes that
+    allocate in their own code come first.
+    """
+    hotspots = {}
+    for s in self.findSlices():
+      if key not in s.args:
+        continue
+      h = hotspots.setdefault(s.name, {"name": s.name, "count": 0,
+                                       "total": 0, "self": 0})
+      h["count"] += 1
+      h["total"] += s.args[key]
+      children = [c.args.get(key, 0) for c in s.children]
+      if key == "alloc_peak_bytes":
+        h["self"] += s.args[key] - max(children + [0])
+      else:
+        h["self"] += s.args[key] - sum(children)
+    return sorted(hotspots.values(), key=lambda h: (-h["self"], h["name"]))
+
+  def findCriticalPath(self, name=None):
+    """
+    Finds where the time of a slice went, following nested slices and flows
+    across threads and processes.
+
+    The slice is the longest one called name, or the longest one in the
+    trace. Walking back from its end, the latest-finishing slice it depended
+    on is assumed to be what it waited for, recursively.
+
+    Returns a list of segments in time order that together cover the slice.
+    Each segment is a dict with the name, pid and tid of the slice whose own
+    code ran during it, and its ts and dur in microseconds.
+    """
+    candidates = [s for s in self.findSlices() if name == None or s.name == name]
+    if not candidates:
+      raise Exception("No slice named %s" % name)
+    root = max(candidates, key=lambda s: s.end - s.start)
+    path = []
+    self._walkCriticalPath(root, path)
+    path.reverse()
+    return path
+
+  def _walkCriticalPath(self, root, path):
+    """Appends the segments of root's critical path to path, latest first.
+
+    Walks back from the end of each slice: the latest-finishing dependency
+    that fits is walked the same way, and the slice's own code ran in the
+    gaps. Uses an explicit stack, since nesting and flows can go deep.
+    """
+    def add_segment(s, start, end):
+      if end > start:
+        path.append({"name": s.name, "pid": s.pid, "tid": s.tid,
+                     "ts": start, "dur": end - start})
+    def frame(s):
+      deps = sorted(s.dependencies(), key=lambda d: d.end, reverse=True)
+      return [s, deps, 0, s.end] # slice, dependencies, next one, time left
+    stack = [frame(root)]
+    while stack:
+      f = stack[-1]
+      s, deps, i, t = f
+      while i < len(deps) and (deps[i].end > t or deps[i].start < s.start):
+        i += 1
+      if i == len(deps):
+        add_segment(s, s.start, t)
+        stack.pop()
+        continue
+      d = deps[i]
+      add_segment(s, d.end, t)
+      f[2] = i + 1
+      f[3] = d.start
+      stack.append(frame(d))
+
+  def downsample(self, max_events=None, min_duration=0, max_depth=None):
+    """
+    Reduces the trace to its coarse structure, so that the viewer stays
+    responsive on traces with millions of tiny slices.
+
+    Slices are written as X events, and async slices, which nest per async
+    id, as b/e pairs. Runs of adjacent slices that have the same name and
+    parent and are each shorter than min_duration microseconds are merged
+    into one slice spanning them, with their number as "count" and summed
+    duration as "total_dur" args. What was nested in them is dropped, as are
+    slices nested deeper than max_depth, top-level slices being at depth 0.
+    Counters keep one sample per min_duration per series, and their last
+    one. Other events are kept as they are.
+
+    Given max_events, min_duration is doubled, and then max_depth lowered,
+    until there are at most max_events events, or nothing is left to reduce.
+
+    Returns a new ParsedTraceEvents.
+    """
+    others = [e for e in self.events if e["ph"] not in "BEXCbe"]
+    slices = self.findSlices() + self._findAsyncSlices()
+    counters = self._counterSeries()
+    def reduce(min_duration, max_depth):
+      return (self._downsampleSlices(slices, min_duration, max_depth) +
+              self._downsampleCounters(counters, min_duration) + others)
+    events = reduce(min_duration, max_depth)
+    if max_events != None and len(events) > max_events:
+      # Larger durations leave fewer events, so bisect for the smallest
+      # power of two times min_duration that fits.
+      times = [e["ts"] for e in self.events if "ts" in e]
+      span = max(times) - min(times) if times else 0
+      base = min_duration or 1
+      low, high = -1, 0
+      while base * 2 ** high <= span:
+        high += 1
+      events = reduce(base * 2 ** high, max_depth)
+      while high - low > 1:
+        mid = (low + high) // 2
+        candidate = reduce(base * 2 ** mid, max_depth)
+        if len(candidate) <= max_events:
+          high, events = mid, candidate
+        else:
+          low = mid
+      min_duration = base * 2 ** high
+      if max_depth == None:
+        max_depth = max([self._depth(s) for s in slices] + [0])
+      while len(events) > max_events and max_depth > 0:
+        max_depth -= 1
+        events = reduce(min_duration, max_depth)
+    events.sort(key=lambda e: e.get("ts", 0))
+    return ParsedTraceEvents(events)
+
+  def _depth(self, s):
+    depth = 0
+    while s.parent:
+      s = s.parent
+      depth += 1
+    return depth
+
+  def _downsampleSlices(self, slices, min_duration, max_depth):
+    roots_by_thread = {}
+    for s in slices:
+      if not s.parent:
+        roots_by_thread.setdefault((s.pid, s.tid, s.id), []).append(s)
+    events = []
+    pending = [(roots, 0) for roots in roots_by_thread.values()]
+    while pending:
+      siblings, depth = pending.pop()
+      if max_depth != None and depth > max_depth:
+        continue
+      i = 0
+      while i < len(siblings):
+        s = siblings[i]
+        j = i + 1
+        if s.end - s.start < min_duration:
+          while (j < len(siblings) and siblings[j].name == s.name and
+                 siblings[j].end - siblings[j].start < min_duration):
+            j += 1
+        if j - i > 1:
+          run = siblings[i:j]
+          args = {"count": len(run),
+                  "total_dur": sum([r.end - r.start for r in run])}
+          events.extend(self._sliceEvents(s, run[-1].end, args))
+        else:
+          events.extend(self._sliceEvents(s, s.end, s.args))
+          if s.children:
+            pending.append((s.children, depth + 1))
+        i = j
+    return events
+
+  def _sliceEvents(self, s, end, args):
+    e = {"ph": "X", "name": s.name, "pid": s.pid, "tid": s.tid,
+         "ts": s.start, "dur": end - s.start, "args": args}
+    if s.category != None:
+      e["category"] = s.category
+    if s.id == None:
+      return [e]
+    e.update({"ph": "b", "id": s.id})
+    del e["dur"]
+    end_event = {"ph": "e", "name": s.name, "pid": s.pid, "tid": s.tid,
+                 "ts": end, "id": s.id, "args": {}}
+    if s.category != None:
+      end_event["category"] = s.category
+    return [e, end_event]
+
+  def _counterSeries(self):
+    series = {}
+    for e in self.events:
+      if e["ph"] == "C":
+        key = (e.get("pid"), e["name"], e.get("id"))
+        series.setdefault(key, []).append(e)
+    for samples in series.values():
+      samples.sort(key=lambda e: e["ts"])
+    return list(series.values())
+
+  def _downsampleCounters(self, series, interval):
+    events = []
+    for samples in series:
+      next_ts = None
+      for e in samples[:-1]:
+        if next_ts == None or e["ts"] >= next_ts:
+          events.append(e)
+          next_ts = e["ts"] + interval
+      events.append(samples[-1])
+    return events
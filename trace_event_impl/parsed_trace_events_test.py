@@ -0,0 +1,185 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import unittest
+from .parsed_trace_events import *
+
+def B(name, ts, tid=1, pid=1):
+  return {"ph": "B", "name": name, "ts": ts, "pid": pid, "tid": tid}
+
+def E(name, ts, tid=1, pid=1):
+  return {"ph": "E", "name": name, "ts": ts, "pid": pid, "tid": tid}
+
+def X(name, ts, dur, tid=1, pid=1):
+  return {"ph": "X", "name": name, "ts": ts, "dur": dur, "pid": pid, "tid": tid}
+
+def Flow(ph, ts, id, tid=1, pid=1, bp=None):
+  e = {"ph": ph, "name": "flow", "ts": ts, "id": id, "pid": pid, "tid": tid}
+  if bp:
+    e["bp"] = bp
+  return e
+
+class CriticalPathTest(unittest.TestCase):
+  def _path(self, events, name=None):
+    path = ParsedTraceEvents(events).findCriticalPath(name)
+    return [(p["name"], p["ts"], p["ts"] + p["dur"]) for p in path]
+
+  def test_nested_slices(self):
+    events = [B("outer", 0), X("a", 10, 20), B("b", 40), E("b", 70), E("outer", 100)]
+    self.assertEquals(
+      [("outer", 0, 10), ("a", 10, 30), ("outer", 30, 40), ("b", 40, 70),
+       ("outer", 70, 100)],
+      self._path(events))
+
+  def test_follows_flows(self):
+    events = [
+      B("request", 0),
+      B("submit", 10), Flow("s", 11, "1:1"), E("submit", 12),
+      B("work", 20, tid=2), Flow("f", 21, "1:1", tid=2, bp="e"),
+      X("compute", 30, 50, tid=2),
+      E("work", 90, tid=2),
+      E("request", 100)]
+    self.assertEquals(
+      [("request", 0, 10), ("submit", 10, 12), ("request", 12, 20),
+       ("work", 20, 30), ("compute", 30, 80), ("work", 80, 90),
+       ("request", 90, 100)],
+      self._path(events, "request"))
+
+  def test_flow_binds_to_next_slice_without_bp(self):
+    events = [
+      B("request", 0), Flow("s", 5, "x"), E("request", 100),
+      Flow("f", 19, "x", pid=2), X("work", 20, 50, pid=2)]
+    self.assertEquals(
+      [("request", 0, 20), ("work", 20, 70), ("request", 70, 100)],
+      self._path(events, "request"))
+
+  def test_ignores_work_finishing_later(self):
+    events = [
+      B("request", 0), Flow("s", 5, "x"), E("request", 50),
+      X("work", 20, 100, tid=2), Flow("f", 21, "x", tid=2, bp="e")]
+    self.assertEquals([("request", 0, 50)], self._path(events, "request"))
+
+  def test_deep_nesting(self):
+    depth = 3000
+    events = ([B("s%i" % i, i) for i in range(depth)] +
+              [E("s%i" % i, 2 * depth - i) for i in reversed(range(depth))])
+    path = self._path(events, "s0")
+    self.assertEquals(2 * depth - 1, len(path))
+    self.assertEquals(("s0", 0, 1), path[0])
+    self.assertEquals(("s%i" % (depth - 1), depth - 1, depth + 1),
+                      path[depth - 1])
+
+  def test_unknown_name(self):
+    self.assertRaises(Exception,
+                      lambda: ParsedTraceEvents([X("a", 0, 1)]).findCriticalPath("b"))
+
+def Allocated(event, alloc_bytes, key="net_alloc_bytes"):
+  event["args"] = {key: alloc_bytes}
+  return event
+
+class AllocationHotspotsTest(unittest.TestCase):
+  def test_ranks_by_self_allocation(self):
+    events = [
+      B("outer", 0), B("inner", 10), Allocated(E("inner", 20), 900),
+      B("inner", 30), Allocated(E("inner", 40), 100),
+      Allocated(E("outer", 100), 1200),
+      Allocated(X("other", 200, 10), 500), X("untracked", 300, 10)]
+    hotspots = ParsedTraceEvents(events).findAllocationHotspots()
+    self.assertEquals(
+      [{"name": "inner", "count": 2, "total": 1000, "self": 1000},
+       {"name": "other", "count": 1, "total": 500, "self": 500},
+       {"name": "outer", "count": 1, "total": 1200, "self": 200}],
+      hotspots)
+
+  def test_peaks_do_not_add_up(self):
+    events = [
+      B("outer", 0),
+      B("inner", 10), Allocated(E("inner", 20), 900, "alloc_peak_bytes"),
+      B("inner", 30), Allocated(E("inner", 40), 700, "alloc_peak_bytes"),
+      Allocated(E("outer", 100), 1000, "alloc_peak_bytes")]
+    hotspots = ParsedTraceEvents(events).findAllocationHotspots(
+        "alloc_peak_bytes")
+    self.assertEquals(
+      [{"name": "inner", "count": 2, "total": 1600, "self": 1600},
+       {"name": "outer", "count": 1, "total": 1000, "self": 100}],
+      hotspots)
+
+def C(name, ts, value, pid=1):
+  return {"ph": "C", "name": name, "ts": ts, "pid": pid, "tid": 1,
+          "args": {"value": value}}
+
+def AsyncBegin(name, ts, id, pid=1):
+  return {"ph": "b", "name": name, "ts": ts, "id": id, "pid": pid, "tid": 1}
+
+def AsyncEnd(name, ts, id, pid=1):
+  return {"ph": "e", "name": name, "ts": ts, "id": id, "pid": pid, "tid": 1}
+
+class DownsampleTest(unittest.TestCase):
+  def _slices(self, res):
+    return [(e["name"], e["ts"], e["ts"] + e["dur"])
+            for e in res if e["ph"] == "X"]
+
+  def test_merges_short_runs(self):
+    events = [B("outer", 0)]
+    for i in range(10):
+      events.extend([B("tiny", 10 + 2 * i), E("tiny", 11 + 2 * i)])
+    events.extend([X("long", 40, 50), X("tiny", 95, 1), E("outer", 100)])
+    res = ParsedTraceEvents(events).downsample(min_duration=5)
+    self.assertEquals(
+      [("outer", 0, 100), ("tiny", 10, 29), ("long", 40, 90), ("tiny", 95, 96)],
+      self._slices(res))
+    self.assertEquals({"count": 10, "total_dur": 10},
+                      res.findByName("tiny")[0]["args"])
+
+  def test_keeps_unfinished_slices(self):
+    events = [B("main", 0)] + [X("t", 10 + 2 * i, 1) for i in range(100)]
+    res = ParsedTraceEvents(events).downsample(min_duration=5)
+    self.assertEquals([("main", 0, 209), ("t", 10, 209)], self._slices(res))
+    self.assertTrue(res.findByName("main")[0]["args"]["did_not_finish"])
+
+  def test_does_not_merge_across_names_or_threads(self):
+    events = [X("a", 0, 1), X("b", 2, 1), X("a", 4, 1),
+              X("a", 0, 1, tid=2), X("a", 2, 1, tid=2)]
+    res = ParsedTraceEvents(events).downsample(min_duration=5)
+    self.assertEquals(4, len(res))
+    self.assertEquals(2, res.findEventsOnThread(2)[0]["args"]["count"])
+
+  def test_caps_depth(self):
+    events = [X("a", 0, 100), X("b", 10, 50), X("c", 20, 10)]
+    res = ParsedTraceEvents(events).downsample(max_depth=1)
+    self.assertEquals([("a", 0, 100), ("b", 10, 60)], self._slices(res))
+
+  def test_thins_counters(self):
+    events = [C("queue", ts, ts) for ts in range(0, 100, 5)]
+    res = ParsedTraceEvents(events).downsample(min_duration=20)
+    self.assertEquals([0, 20, 40, 60, 80, 95], [e["ts"] for e in res])
+
+  def test_meets_budget(self):
+    events = [{"ph": "M", "name": "process_argv", "ts": 0, "pid": 1, "tid": 1,
+               "args": {}}, B("main", 0)]
+    for i in range(1000):
+      events.extend([B("step", 10 * i), X("tiny", 10 * i, 1), E("step", 10 * i + 5)])
+      events.append(C("memory", 10 * i, i))
+    events.append(E("main", 10000))
+    res = ParsedTraceEvents(events).downsample(max_events=50)
+    self.assertTrue(len(res) <= 50)
+    self.assertEquals(1, len(res.findByName("process_argv")))
+    self.assertEquals([("main", 0, 10000)], self._slices(res.findByName("main")))
+    steps = res.findByName("step")
+    self.assertEquals(1000, sum([e["args"]["count"] for e in steps]))
+
+  def test_async_slices(self):
+    events = [AsyncBegin("request", 0, 1)]
+    for i in range(50):
+      events.extend([AsyncBegin("step", 10 + 2 * i, 1),
+                     AsyncEnd("step", 11 + 2 * i, 1)])
+    events.extend([AsyncEnd("request", 200, 1),
+                   AsyncBegin("request", 0, 2), AsyncEnd("request", 150, 2)])
+    res = ParsedTraceEvents(events).downsample(max_events=10)
+    self.assertTrue(len(res) <= 10)
+    requests = res.findByName("request")
+    self.assertEquals(["b", "b", "e", "e"], [e["ph"] for e in requests])
+    steps = res.findByName("step")
+    self.assertEquals(["b", "e"], [e["ph"] for e in steps])
+    self.assertEquals(1, steps[0]["id"])
+    self.assertEquals(50, steps[0]["args"]["count"])
@@ -0,0 +1,174 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import errno
+import fcntl
+import glob
+import mmap
+import os
+import re
+import struct
+import sys
+
+_MAGIC = b"PYTERNG1"
+# magic, capacity, head, tail, dropped. head and tail are offsets into the
+# stream of records ever written; the data area is indexed modulo capacity.
+_HEADER = struct.Struct("<8sQQQQ")
+_LENGTH = struct.Struct("<I")
+
+class RingBufferException(Exception):
+  pass
+
+class RingBuffer(object):
+  """A file-backed ring of length-prefixed records, shared through mmap.
+
+  Appending only touches memory, yet everything appended survives the
+  process crashing, because the kernel owns the pages. When the ring is full,
+  the oldest records are dropped. head and tail are only updated after the
+  data they cover is in place, so a crash mid-append loses at most the
+  record being appended.
+  """
+  def __init__(self, path, capacity=None):
+    """Opens the ring at path, creating it with capacity bytes if needed."""
+    self.path = path
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      size = os.fstat(fd).st_size
+      if size == 0:
+        if not capacity:
+          raise RingBufferException("%s is empty" % path)
+        os.ftruncate(fd, _HEADER.size + capacity)
+        size = _HEADER.size + capacity
+      self._map = mmap.mmap(fd, size)
+    finally:
+      os.close(fd)
+    magic = self._map[0:len(_MAGIC)]
+    if magic == b"\0" * len(_MAGIC):
+      _HEADER.pack_into(self._map, 0, _MAGIC, size - _HEADER.size, 0, 0, 0)
+    elif magic != _MAGIC:
+      self._map.close()
+      raise RingBufferException("%s is not a ring buffer" % path)
+    self.capacity = _HEADER.unpack_from(self._map, 0)[1]
+
+  def _header(self):
+    return _HEADER.unpack_from(self._map, 0)[2:]
+
+  def _set_header(self, head, tail, dropped):
+    _HEADER.pack_into(self._map, 0, _MAGIC, self.capacity, head, tail, dropped)
+
+  def _write(self, offset, data):
+    start = _HEADER.size + offset % self.capacity
+    first = min(len(data), _HEADER.size + self.capacity - start)
+    self._map[start:start + first] = data[:first]
+    if first < len(data):
+      self._map[_HEADER.size:_HEADER.size + len(data) - first] = data[first:]
+
+  def _read(self, offset, n):
+    start = _HEADER.size + offset % self.capacity
+    first = min(n, _HEADER.size + self.capacity - start)
+    data = self._map[start:start + first]
+    if first < n:
+      data += self._map[_HEADER.size:_HEADER.size + n - first]
+    return data
+
+  def append(self, data):
+    head, tail, dropped = self._header()
+    size = _LENGTH.size + len(data)
+    if size > self.capacity:
+      self._set_header(head, tail, dropped + 1)
+      return
+    if tail + size - head > self.capacity:
+      while tail + size - head > self.capacity:
+        head += _LENGTH.size + _LENGTH.unpack(self._read(head, _LENGTH.size))[0]
+        dropped += 1
+      self._set_header(head, tail, dropped)
+    self._write(tail, _LENGTH.pack(len(data)) + data)
+    self._set_header(head, tail + size, dropped)
+
+  def read(self):
+    """Returns the records that were not consumed yet, oldest first."""
+    head, tail, dropped = self._header()
+    records = []
+    while head < tail:
+      n = _LENGTH.unpack(self._read(head, _LENGTH.size))[0]
+      records.append(self._read(head + _LENGTH.size, n))
+      head += _LENGTH.size + n
+    return records
+
+  def consume(self):
+    """Returns the records that were not consumed yet and drops them."""
+    records = self.read()
+    head, tail, dropped = self._header()
+    self._set_header(tail, tail, dropped)
+    return records
+
+  @property
+  def dropped(self):
+    return self._header()[2]
+
+  @property
+  def used(self):
+    """Bytes taken by the records not consumed yet, with their lengths."""
+    head, tail, dropped = self._header()
+    return tail - head
+
+  def close(self, unlink=False):
+    self._map.close()
+    if unlink:
+      os.unlink(self.path)
+
+def ring_buffer_path(log_file_name, pid):
+  return "%s.%i.ring" % (log_file_name, pid)
+
+def _pid_is_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    return e.errno == errno.EPERM
+  return True
+
+def recover_ring_buffers(log_file_name, include_live=False):
+  """Appends the unflushed events left in ring buffers to the log file.
+
+  Ring buffers belong to the processes that traced into log_file_name with
+  ring buffers enabled. Those of processes that are still running are left
+  alone unless include_live is set. Recovered ring buffers are deleted.
+  Returns the number of events recovered.
+  """
+  escape = getattr(glob, "escape", lambda s: s)
+  pattern = re.compile(r"\.(\d+)\.ring$")
+  recovered = 0
+  for path in glob.glob(escape(log_file_name) + ".*.ring"):
+    m = pattern.search(path)
+    if not m:
+      continue
+    pid = int(m.group(1))
+    if pid == os.getpid() or (_pid_is_alive(pid) and not include_live):
+      continue
+    ring = RingBuffer(path)
+    records = [r.decode("utf-8") for r in ring.read()]
+    _append_to_log(log_file_name, records)
+    ring.close(unlink=True)
+    recovered += len(records)
+  return recovered
+
+def _append_to_log(log_file_name, records):
+  if not records:
+    return
+  with open(log_file_name, "a") as f:
+    fcntl.lockf(f.fileno(), fcntl.LOCK_EX)
+    try:
+      f.seek(0, os.SEEK_END)
+      if f.tell() == 0:
+        f.write("[")
+      else:
+        f.write(",\n")
+      f.write(",\n".join(records))
+      f.flush()
+    finally:
+      fcntl.lockf(f.fileno(), fcntl.LOCK_UN)
+
+if __name__ == "__main__":
+  if len(sys.argv) != 2:
+    raise Exception("Expected: trace file name")
+  print("Recovered %i events" % recover_ring_buffers(sys.argv[1]))
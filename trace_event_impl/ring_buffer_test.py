@@ -0,0 +1,105 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+import unittest
+from .log import *
+from .parsed_trace_events import *
+from .ring_buffer import *
+from .trace_test import *
+
+def RecordThenHang():
+  trace_begin("child")
+  trace_end("child")
+  while True:
+    time.sleep(1)
+
+class RingBufferTest(unittest.TestCase):
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self.path = os.path.join(self._dir, "test.ring")
+
+  def tearDown(self):
+    for name in os.listdir(self._dir):
+      os.unlink(os.path.join(self._dir, name))
+    os.rmdir(self._dir)
+
+  def test_append_and_consume(self):
+    ring = RingBuffer(self.path, 64)
+    ring.append(b"one")
+    ring.append(b"two")
+    self.assertEquals([b"one", b"two"], ring.read())
+    self.assertEquals([b"one", b"two"], ring.consume())
+    self.assertEquals([], ring.read())
+    ring.close()
+
+  def test_survives_reopen(self):
+    ring = RingBuffer(self.path, 64)
+    ring.append(b"one")
+    ring.close()
+    ring = RingBuffer(self.path)
+    self.assertEquals([b"one"], ring.read())
+    ring.close()
+
+  def test_drops_oldest_when_full(self):
+    ring = RingBuffer(self.path, 32)
+    for i in range(10):
+      ring.append(("record%i" % i).encode("utf-8"))
+    records = ring.read()
+    self.assertEquals(b"record9", records[-1])
+    self.assertEquals(10, len(records) + ring.dropped)
+    ring.close()
+
+  def test_oversized_record_is_dropped(self):
+    ring = RingBuffer(self.path, 16)
+    ring.append(b"x" * 100)
+    self.assertEquals([], ring.read())
+    self.assertEquals(1, ring.dropped)
+    ring.close()
+
+  def test_rejects_other_files(self):
+    with open(self.path, "w") as f:
+      f.write("not a ring buffer, not at all")
+    self.assertRaises(RingBufferException, lambda: RingBuffer(self.path))
+
+class RingBufferTracingTest(TraceTest):
+  def go_ring(self, cb):
+    self._file = tempfile.NamedTemporaryFile()
+    trace_enable(self._file.name, ring_buffer_size=1 << 16)
+    try:
+      cb()
+    finally:
+      trace_disable()
+    e = ParsedTraceEvents(trace_filename = self._file.name)
+    self._file.close()
+    self._file = None
+    return e
+
+  def test_events_go_through_ring_buffer(self):
+    def work():
+      trace_begin("work")
+      trace_end("work")
+      self.assertTrue(os.path.exists(
+          ring_buffer_path(self.trace_filename, os.getpid())))
+    res = self.go_ring(work)
+    self.assertEquals(2, len(res.findByName("work")))
+
+  def test_recovers_killed_child(self):
+    def work():
+      p = multiprocessing.Process(target=RecordThenHang)
+      p.start()
+      time.sleep(0.5)
+      os.kill(p.pid, signal.SIGKILL)
+      p.join()
+    res = self.go_ring(work)
+    self.assertEquals(2, len(res.findByName("child")))
+
+  def test_requires_named_log_file(self):
+    file = tempfile.NamedTemporaryFile()
+    self.assertRaises(TraceException,
+                      lambda: trace_enable(open(file.name, "a"), ring_buffer_size=1024))
+    self.assertFalse(trace_is_enabled())
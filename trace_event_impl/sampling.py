@@ -0,0 +1,162 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import gc
+import os
+import sys
+import threading
+import time
+
+from . import log
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+_stack_sampler = None
+_resource_sampler = None
+
+class _PeriodicThread(threading.Thread):
+  """Daemon thread that calls sample() every interval seconds until stopped."""
+  def __init__(self, name, interval, sample):
+    threading.Thread.__init__(self, name=name)
+    self.daemon = True
+    self._interval = interval
+    self._sample = sample
+    self._stopped = threading.Event()
+
+  def run(self):
+    while not self._stopped.is_set():
+      if log._enabled:
+        self._sample()
+      self._stopped.wait(self._interval)
+
+  def stop(self):
+    self._stopped.set()
+    if threading.current_thread() is not self:
+      self.join()
+
+def sampling_enable(interval=0.005, max_depth=64):
+  """Periodically records the Python stack of every thread.
+
+  Every interval seconds, a background thread captures the stack of each
+  thread and records it as a "P" (sample) event on that thread, next to the
+  regular trace events. The "stack" arg lists the frames outermost first, as
+  "module.function:line", truncated to the innermost max_depth frames.
+
+  The cost is bounded by the sampling rate rather than by what the program
+  does, so it is safe to leave on for untraced code. Samples are only taken
+  while tracing is enabled. The sampler does not follow forks.
+  """
+  global _stack_sampler
+  if _stack_sampler:
+    raise log.TraceException("Sampling already enabled")
+  _stack_sampler = _PeriodicThread(
+      "trace_event_sampler", interval, lambda: _sample_stacks(max_depth))
+  _stack_sampler.start()
+
+def sampling_disable():
+  global _stack_sampler
+  if not _stack_sampler:
+    return
+  _stack_sampler.stop()
+  _stack_sampler = None
+
+def sampling_is_enabled():
+  return _stack_sampler != None
+
+_code_names = {} # code object -> "module.function"
+
+def _frame_name(frame):
+  code = frame.f_code
+  try:
+    name = _code_names[code]
+  except KeyError:
+    module = frame.f_globals.get("__name__", "?")
+    name = _code_names[code] = "%s.%s" % (module, code.co_name)
+  return "%s:%i" % (name, frame.f_lineno)
+
+def _sample_stacks(max_depth):
+  ts = time.time()
+  me = threading.current_thread().ident
+  for tid, frame in sys._current_frames().items():
+    if tid == me:
+      continue
+    stack = []
+    while frame and len(stack) < max_depth:
+      stack.append(_frame_name(frame))
+      frame = frame.f_back
+    stack.reverse()
+    log.add_trace_event("P", ts, "python.sample", "sample",
+                        {"stack": stack}, tid=tid)
+
+def resource_sampling_enable(interval=1.0):
+  """Periodically records process resource usage as counter events.
+
+  Every interval seconds, a background thread records these counters:
+    memory: resident set size in bytes ("rss").
+    cpu_time: user and system CPU seconds used by the process.
+    gc: gc.get_count(), the values the collector compares against
+      gc.get_threshold(). "gen0" is allocations minus deallocations since
+      generation 0 was last collected; "gen1" and "gen2" are how many times
+      the next younger generation was collected since they last were.
+    threads: number of live Python threads.
+    trace_event_buffer: what is recorded and not written out yet. That is
+      the "events" buffered in memory, or with a ring buffer, the "bytes" it
+      holds, or with a StreamSink, the "events" it has queued. The latter
+      two also report how many events they "dropped".
+
+  Counters are only recorded while tracing is enabled. The sampler does not
+  follow forks.
+  """
+  global _resource_sampler
+  if _resource_sampler:
+    raise log.TraceException("Resource sampling already enabled")
+  _resource_sampler = _PeriodicThread(
+      "trace_event_resource_sampler", interval, _sample_resources)
+  _resource_sampler.start()
+
+def resource_sampling_disable():
+  global _resource_sampler
+  if not _resource_sampler:
+    return
+  _resource_sampler.stop()
+  _resource_sampler = None
+
+def resource_sampling_is_enabled():
+  return _resource_sampler != None
+
+def _rss():
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except (IOError, OSError, ValueError):
+    pass
+  if resource:
+    # Only the peak is available here. Linux reports it in kilobytes.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+      rss *= 1024
+    return rss
+  return None
+
+def _sample_resources():
+  rss = _rss()
+  if rss != None:
+    log.trace_counter("memory", rss=rss)
+  times = os.times()
+  log.trace_counter("cpu_time", user=times[0], system=times[1])
+  gen0, gen1, gen2 = gc.get_count()
+  log.trace_counter("gc", gen0=gen0, gen1=gen1, gen2=gen2)
+  log.trace_counter("threads", count=threading.active_count())
+  log.trace_counter("trace_event_buffer", **_buffered())
+
+def _buffered():
+  with log._lock:
+    if log._ring_buffer:
+      return {"bytes": log._ring_buffer.used,
+              "dropped": log._ring_buffer.dropped}
+    if log._sink:
+      return {"events": log._sink.queued, "dropped": log._sink.dropped}
+    return {"events": len(log._cur_events)}
@@ -0,0 +1,125 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from . import sampling
+from .log import *
+from .sampling import *
+from .streaming import *
+from .trace_test import *
+
+def busy_wait(duration):
+  end = time.time() + duration
+  while time.time() < end:
+    pass
+
+class SamplingTest(TraceTest):
+  def tearDown(self):
+    sampling_disable()
+    TraceTest.tearDown(self)
+
+  def test_samples_current_thread(self):
+    def work():
+      sampling_enable(interval=0.01)
+      try:
+        trace_begin("work")
+        busy_wait(0.2)
+        trace_end("work")
+      finally:
+        sampling_disable()
+    res = self.go(work)
+    tid = res.findByName("work")[0]["tid"]
+    samples = res.findByPhase("P").findEventsOnThread(tid)
+    self.assertTrue(len(samples) > 5)
+    self.assertTrue([s for s in samples if
+                     s["args"]["stack"][-1].startswith("%s.busy_wait:" % __name__)])
+
+  def test_samples_other_threads(self):
+    def work():
+      t = threading.Thread(target=lambda: busy_wait(0.2))
+      sampling_enable(interval=0.01)
+      try:
+        t.start()
+        t.join()
+      finally:
+        sampling_disable()
+      return t.ident
+    tids = []
+    res = self.go(lambda: tids.append(work()))
+    self.assertTrue(len(res.findByPhase("P").findEventsOnThread(tids[0])) > 5)
+
+  def test_max_depth(self):
+    def work():
+      sampling_enable(interval=0.01, max_depth=2)
+      try:
+        busy_wait(0.1)
+      finally:
+        sampling_disable()
+    res = self.go(work)
+    for s in res.findByPhase("P"):
+      self.assertTrue(len(s["args"]["stack"]) <= 2)
+
+  def test_enable_without_tracing(self):
+    sampling_enable(interval=0.01)
+    busy_wait(0.05)
+    sampling_disable()
+    self.assertFalse(sampling_is_enabled())
+
+class CounterTest(TraceTest):
+  def tearDown(self):
+    resource_sampling_disable()
+    TraceTest.tearDown(self)
+
+  def test_trace_counter(self):
+    res = self.go(lambda: trace_counter("queue", pending=3, done=4))
+    events = res.findByPhase("C")
+    self.assertEquals(1, len(events))
+    self.assertEquals("queue", events[0]["name"])
+    self.assertEquals({"pending": 3, "done": 4}, events[0]["args"])
+
+  def test_resource_sampling(self):
+    def work():
+      resource_sampling_enable(interval=0.01)
+      try:
+        time.sleep(0.1)
+      finally:
+        resource_sampling_disable()
+    res = self.go(work)
+    for name in ["memory", "cpu_time", "gc", "threads", "trace_event_buffer"]:
+      self.assertTrue(len(res.findByName(name)) > 0, name)
+    self.assertTrue(res.findByName("memory")[0]["args"]["rss"] > 0)
+    self.assertTrue(res.findByName("threads")[0]["args"]["count"] >= 2)
+
+  def test_buffer_counter_with_ring_buffer(self):
+    d = tempfile.mkdtemp()
+    try:
+      trace_enable(os.path.join(d, "trace.json"), ring_buffer_size=4096)
+      trace_begin("work")
+      trace_end("work")
+      buffered = sampling._buffered()
+      self.assertTrue(buffered["bytes"] > 0)
+      self.assertEquals(0, buffered["dropped"])
+      trace_disable()
+    finally:
+      shutil.rmtree(d)
+
+  def test_buffer_counter_with_sink(self):
+    d = tempfile.mkdtemp()
+    try:
+      # Nothing listens, so events queue up and get dropped.
+      trace_enable(StreamSink(os.path.join(d, "collector.sock"),
+                              max_queued_events=3, reconnect_interval=10))
+      for i in range(3):
+        trace_begin("work")
+        trace_end("work")
+      buffered = sampling._buffered()
+      self.assertTrue(buffered["events"] > 0)
+      self.assertTrue(buffered["dropped"] > 0)
+      trace_disable()
+    finally:
+      shutil.rmtree(d)
@@ -0,0 +1,177 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import collections
+import json
+import os
+import socket
+import threading
+import time
+
+# The wire format is one JSON encoded trace event per line.
+
+def parse_address(spec):
+  """Parses "unix:<path>" or "tcp:<host>:<port>" into a socket address."""
+  kind, _, rest = spec.partition(":")
+  if kind == "unix" and rest:
+    return rest
+  if kind == "tcp":
+    host, _, port = rest.rpartition(":")
+    if host and port.isdigit():
+      return (host, int(port))
+  raise ValueError("Expected unix:<path> or tcp:<host>:<port>, got %r" % spec)
+
+def format_address(address):
+  if isinstance(address, tuple):
+    return "tcp:%s:%i" % address[:2]
+  return "unix:%s" % address
+
+def _family(address):
+  if isinstance(address, tuple):
+    return socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+  return socket.AF_UNIX
+
+class StreamSink(object):
+  """Streams trace events to a collector while they are recorded.
+
+  Pass it to trace_enable instead of a log file. address is the path of a
+  UNIX domain socket or a (host, port) tuple for TCP. Events are queued, up
+  to max_queued_events of them, and sent in batches of up to batch_size by a
+  background thread, which reconnects every reconnect_interval seconds while
+  the collector is unreachable.
+
+  When the queue is full, recording an event waits up to block_timeout
+  seconds for room, and then drops the event. Dropped events are counted in
+  dropped, and reported to the collector as a "trace_event_stream" counter.
+  """
+  def __init__(self, address, max_queued_events=10000, batch_size=256,
+               block_timeout=0.0, reconnect_interval=1.0):
+    self.address = address
+    self.max_queued_events = max_queued_events
+    self.batch_size = batch_size
+    self.block_timeout = block_timeout
+    self.reconnect_interval = reconnect_interval
+    self.dropped = 0
+    self.pid = None
+    # Re-entrant, since gc callbacks can record events from inside it.
+    self._cond = threading.Condition(threading.RLock())
+    self._events = collections.deque()
+    self._in_flight = 0
+    self._reported_dropped = 0
+    self._closing = False
+    self._socket = None
+    self._thread = None
+
+  def __reduce__(self):
+    # Only the settings are sent along to other processes.
+    return (StreamSink, (self.address, self.max_queued_events,
+                         self.batch_size, self.block_timeout,
+                         self.reconnect_interval))
+
+  def copy(self):
+    """Returns an unstarted sink with the same settings."""
+    cls, args = self.__reduce__()
+    return cls(*args)
+
+  def start(self):
+    self.pid = os.getpid()
+    self._closing = False
+    self._thread = threading.Thread(target=self._run,
+                                    name="trace_event_stream")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def put(self, event):
+    with self._cond:
+      if len(self._events) >= self.max_queued_events and self.block_timeout:
+        deadline = time.time() + self.block_timeout
+        while (len(self._events) >= self.max_queued_events and
+               time.time() < deadline):
+          self._cond.wait(deadline - time.time())
+      if len(self._events) >= self.max_queued_events:
+        self.dropped += 1
+        return
+      self._events.append(event)
+      self._cond.notify_all()
+
+  @property
+  def queued(self):
+    """Events waiting to be sent."""
+    with self._cond:
+      return len(self._events) + self._in_flight
+
+  def flush(self, timeout=1.0):
+    """Waits up to timeout seconds for the queued events to be sent.
+    Returns whether they were."""
+    deadline = time.time() + timeout
+    with self._cond:
+      while self._events or self._in_flight:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return False
+        self._cond.wait(remaining)
+    return True
+
+  def close(self, timeout=1.0):
+    """Sends what is queued, waiting up to timeout seconds, and disconnects."""
+    self.flush(timeout)
+    with self._cond:
+      self._closing = True
+      self._cond.notify_all()
+    if self._thread and self._thread is not threading.current_thread():
+      self._thread.join(timeout)
+    self._thread = None
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while not self._events and not self._closing:
+          self._cond.wait()
+        if self._closing:
+          break
+        batch = [self._events.popleft()
+                 for i in range(min(self.batch_size, len(self._events)))]
+        self._in_flight = len(batch)
+        if self.dropped != self._reported_dropped:
+          self._reported_dropped = self.dropped
+          batch.append(self._dropped_event())
+      data = "".join(["%s\n" % json.dumps(e) for e in batch]).encode("utf-8")
+      self._send(data)
+      with self._cond:
+        self._in_flight = 0
+        self._cond.notify_all()
+    self._disconnect()
+
+  def _dropped_event(self):
+    return {"ph": "C", "category": "trace_event", "pid": self.pid, "tid": 0,
+            "ts": 1000000 * time.time(), "name": "trace_event_stream",
+            "args": {"dropped": self.dropped}}
+
+  def _send(self, data):
+    # Keeps retrying while events queue up behind, and get dropped once the
+    # queue is full. Gives up when closing.
+    while not self._closing:
+      try:
+        if not self._socket:
+          self._connect()
+        self._socket.sendall(data)
+        return
+      except socket.error:
+        self._disconnect()
+        # Waits out the whole interval, since put() notifies for every event.
+        deadline = time.time() + self.reconnect_interval
+        with self._cond:
+          while not self._closing and time.time() < deadline:
+            self._cond.wait(deadline - time.time())
+
+  def _connect(self):
+    self._socket = socket.socket(_family(self.address), socket.SOCK_STREAM)
+    self._socket.connect(self.address)
+
+  def _disconnect(self):
+    if self._socket:
+      try:
+        self._socket.close()
+      except socket.error:
+        pass
+      self._socket = None
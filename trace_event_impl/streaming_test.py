@@ -0,0 +1,168 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from .collector import *
+from .gc_tracing import *
+from .log import *
+from .parsed_trace_events import *
+from .streaming import *
+
+def _wait_until(condition, timeout=5.0):
+  deadline = time.time() + timeout
+  while not condition():
+    if time.time() > deadline:
+      return False
+    time.sleep(0.01)
+  return True
+
+def DoWork():
+  trace_begin("child")
+  trace_end("child")
+
+class CountingSink(StreamSink):
+  def __init__(self, *args, **kwargs):
+    StreamSink.__init__(self, *args, **kwargs)
+    self.connects = 0
+
+  def _connect(self):
+    self.connects += 1
+    StreamSink._connect(self)
+
+class StreamingTest(unittest.TestCase):
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self.socket_path = os.path.join(self._dir, "collector.sock")
+    self.output = os.path.join(self._dir, "trace.json")
+    self.collector = None
+
+  def tearDown(self):
+    if trace_is_enabled():
+      trace_disable()
+    if self.collector:
+      self.collector.close()
+    shutil.rmtree(self._dir)
+
+  def collect(self, address):
+    self.collector = Collector(address, self.output)
+    self.collector.start()
+    return self.collector
+
+  def collected(self):
+    self.collector.close()
+    self.collector = None
+    return ParsedTraceEvents(trace_filename=self.output)
+
+  def test_unix_socket(self):
+    self.collect(self.socket_path)
+    trace_enable(StreamSink(self.socket_path))
+    trace_begin("work")
+    trace_end("work")
+    trace_disable()
+    res = self.collected()
+    self.assertEquals(1, len(res.findByName("process_argv")))
+    self.assertEquals(2, len(res.findByName("work")))
+
+  def test_tcp(self):
+    collector = self.collect(("127.0.0.1", 0))
+    trace_enable(StreamSink(collector.address))
+    trace_begin("work")
+    trace_end("work")
+    trace_disable()
+    self.assertEquals(2, len(self.collected().findByName("work")))
+
+  def test_metrics(self):
+    collector = self.collect(self.socket_path)
+    sink = StreamSink(self.socket_path)
+    trace_enable(sink)
+    for i in range(3):
+      trace_begin("work")
+      trace_end("work")
+    self.assertTrue(sink.flush())
+    self.assertTrue(_wait_until(lambda: collector.metrics()["events"] == 7))
+    metrics = collector.metrics(reset=True)
+    self.assertEquals(7, metrics["events"])
+    self.assertEquals({os.getpid(): 7}, metrics["processes"])
+    self.assertEquals(3, metrics["slices"]["work"]["count"])
+    self.assertEquals(0, collector.metrics()["events"])
+
+  def test_drops_when_queue_is_full(self):
+    sink = StreamSink(self.socket_path, max_queued_events=10,
+                      reconnect_interval=0.01)
+    trace_enable(sink)
+    for i in range(50):
+      trace_begin("work")
+      trace_end("work")
+    self.assertTrue(sink.dropped >= 80)
+    # The collector comes up late, and learns about the drops.
+    collector = self.collect(self.socket_path)
+    self.assertTrue(sink.flush(5.0))
+    trace_begin("late")
+    trace_end("late")
+    self.assertTrue(sink.flush(5.0))
+    self.assertTrue(_wait_until(
+        lambda: os.getpid() in collector.metrics()["dropped"]))
+    self.assertEquals(sink.dropped,
+                      collector.metrics()["dropped"][os.getpid()])
+    trace_disable()
+    self.assertEquals(2, len(self.collected().findByName("late")))
+
+  def test_reconnects_every_interval(self):
+    sink = CountingSink(self.socket_path, reconnect_interval=0.25)
+    trace_enable(sink)
+    deadline = time.time() + 0.6
+    while time.time() < deadline:
+      trace_begin("work")
+      trace_end("work")
+      time.sleep(0.001)
+    self.assertTrue(1 <= sink.connects <= 4)
+
+  @unittest.skipIf(not hasattr(gc, "callbacks"), "requires gc.callbacks")
+  def test_gc_on_sender_thread_does_not_deadlock(self):
+    # The sender holds the sink's lock, which put() takes under the log's.
+    self.collect(self.socket_path)
+    trace_enable(StreamSink(self.socket_path, max_queued_events=1000000))
+    threshold = gc.get_threshold()
+    gc_tracing_enable()
+    gc.set_threshold(1, 1, 1)
+    def work():
+      for i in range(2000):
+        trace_begin("work")
+        trace_end("work")
+    threads = [threading.Thread(target=work) for i in range(4)]
+    for t in threads:
+      t.daemon = True
+      t.start()
+    try:
+      for t in threads:
+        t.join(20)
+        self.assertFalse(t.is_alive())
+    finally:
+      gc.set_threshold(*threshold)
+      gc_tracing_disable()
+    trace_disable()
+
+  def test_child_process(self):
+    self.collect(self.socket_path)
+    trace_enable(StreamSink(self.socket_path))
+    p = multiprocessing.Process(target=DoWork)
+    p.start()
+    p.join()
+    trace_disable()
+    child_events = self.collected().findByName("child")
+    self.assertEquals(2, len(child_events))
+    self.assertEquals(p.pid, child_events[0]["pid"])
+
+  def test_addresses(self):
+    self.assertEquals("/tmp/s", parse_address("unix:/tmp/s"))
+    self.assertEquals(("localhost", 9000), parse_address("tcp:localhost:9000"))
+    self.assertEquals("tcp:localhost:9000", format_address(("localhost", 9000)))
+    self.assertRaises(ValueError, lambda: parse_address("tcp:localhost"))
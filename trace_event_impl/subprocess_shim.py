@@ -0,0 +1,94 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import os
+import subprocess
+import warnings
+from . import log
+from . import sampling
+from . import streaming
+
+# The environment contract: a process that imports trace_event_impl with
+# these set enables tracing into the given log file by itself.
+LOG_FILE_VARIABLE = "TRACE_EVENT_LOG_FILE"
+STREAM_VARIABLE = "TRACE_EVENT_STREAM"
+RING_BUFFER_SIZE_VARIABLE = "TRACE_EVENT_RING_BUFFER_SIZE"
+SAMPLING_INTERVAL_VARIABLE = "TRACE_EVENT_SAMPLING_INTERVAL"
+MAX_FILE_SIZE_VARIABLE = "TRACE_EVENT_MAX_FILE_SIZE"
+MAX_FILE_AGE_VARIABLE = "TRACE_EVENT_MAX_FILE_AGE"
+KEEP_FILES_VARIABLE = "TRACE_EVENT_KEEP_FILES"
+
+_RealPopen = subprocess.Popen
+
+__all__ = ["PopenShim", "trace_subprocess_environment"]
+
+def trace_subprocess_environment(env=None):
+  """Returns env, or os.environ, plus what makes a child trace along.
+
+  Python children that import trace_event_impl with the returned environment
+  record into this process's log file or stream, with the same ring buffer,
+  rotation and stack sampling settings. subprocess.Popen does this
+  automatically; use this for other ways of starting processes, e.g.
+  os.spawnve. Returns a copy of env unchanged when tracing is disabled or the
+  log file has no name.
+  """
+  env = dict(os.environ if env == None else env)
+  name = log._log_file_name()
+  if not log._enabled or not (name or log._sink):
+    return env
+  env.pop(LOG_FILE_VARIABLE, None)
+  env.pop(STREAM_VARIABLE, None)
+  if log._sink:
+    address = log._sink.address
+    if not isinstance(address, tuple):
+      address = os.path.abspath(address)
+    env[STREAM_VARIABLE] = streaming.format_address(address)
+  else:
+    env[LOG_FILE_VARIABLE] = os.path.abspath(name)
+  for variable, value in ((RING_BUFFER_SIZE_VARIABLE, log._ring_buffer_size),
+                          (MAX_FILE_SIZE_VARIABLE, log._max_file_size),
+                          (MAX_FILE_AGE_VARIABLE, log._max_file_age),
+                          (KEEP_FILES_VARIABLE, log._keep_files)):
+    env.pop(variable, None)
+    if value != None:
+      env[variable] = str(value)
+  env.pop(SAMPLING_INTERVAL_VARIABLE, None)
+  if sampling._stack_sampler:
+    env[SAMPLING_INTERVAL_VARIABLE] = repr(sampling._stack_sampler._interval)
+  return env
+
+def _enable_from_environment():
+  name = os.environ.get(LOG_FILE_VARIABLE)
+  stream = os.environ.get(STREAM_VARIABLE)
+  if not (name or stream) or log._enabled:
+    return
+  try:
+    def get(variable, convert):
+      value = os.environ.get(variable)
+      return convert(value) if value else None
+    if stream:
+      log.trace_enable(streaming.StreamSink(streaming.parse_address(stream)))
+    else:
+      log.trace_enable(name, get(RING_BUFFER_SIZE_VARIABLE, int),
+                       get(MAX_FILE_SIZE_VARIABLE, int),
+                       get(MAX_FILE_AGE_VARIABLE, float),
+                       get(KEEP_FILES_VARIABLE, int))
+    log._enabled_from_environment = True
+    sampling_interval = os.environ.get(SAMPLING_INTERVAL_VARIABLE)
+    if sampling_interval and not sampling.sampling_is_enabled():
+      sampling.sampling_enable(float(sampling_interval))
+  except (EnvironmentError, ValueError, log.TraceException) as e:
+    # Tracing must never keep the child from running.
+    warnings.warn("trace_event: not tracing into %s: %s" % (stream or name, e))
+
+class PopenShim(_RealPopen):
+  def __init__(self, *args, **kwargs):
+    # env is the eleventh positional argument; leave callers passing it that
+    # way alone.
+    if log._enabled and len(args) <= 10:
+      kwargs["env"] = trace_subprocess_environment(kwargs.get("env"))
+    _RealPopen.__init__(self, *args, **kwargs)
+
+# Monkeypatch in our Popen replacement.
+if subprocess.Popen != PopenShim:
+  subprocess.Popen = PopenShim
@@ -0,0 +1,66 @@
+# Copyright 2011 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import os
+import subprocess
+import sys
+import unittest
+from .log import *
+from .sampling import *
+from .subprocess_shim import *
+from .subprocess_shim import LOG_FILE_VARIABLE, SAMPLING_INTERVAL_VARIABLE
+from .trace_test import *
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = """
+import trace_event_impl
+trace_event_impl.trace_begin("child")
+trace_event_impl.trace_end("child")
+"""
+
+_CHECK_VARIABLE = """
+import os, sys
+sys.exit(%r in os.environ)
+""" % LOG_FILE_VARIABLE
+
+class SubprocessShimTest(TraceTest):
+  def test_shimmed(self):
+    self.assertTrue(issubclass(subprocess.Popen, PopenShim))
+
+  def test_child_traces_into_parent_log(self):
+    def work():
+      trace_begin("parent")
+      subprocess.check_call([sys.executable, "-c", _CHILD], cwd=_ROOT)
+      trace_end("parent")
+    res = self.go(work)
+    self.assertEquals(2, len(res.findByName("parent")))
+    child_events = res.findByName("child")
+    self.assertEquals(2, len(child_events))
+    self.assertNotEquals(os.getpid(), child_events[0]["pid"])
+
+  def test_explicit_env_is_kept(self):
+    def work():
+      env = dict(os.environ, TRACE_EVENT_TEST="1")
+      subprocess.check_call(
+          [sys.executable, "-c",
+           "import os, sys; sys.exit(os.environ['TRACE_EVENT_TEST'] != '1')"],
+          env=env)
+      self.assertFalse(LOG_FILE_VARIABLE in env)
+    self.go(work)
+
+  def test_nothing_injected_when_disabled(self):
+    self.assertEquals(0, subprocess.call([sys.executable, "-c", _CHECK_VARIABLE]))
+
+  def test_subprocess_environment(self):
+    def work():
+      sampling_enable(interval=0.5)
+      try:
+        env = trace_subprocess_environment({})
+      finally:
+        sampling_disable()
+      self.assertEquals(os.path.abspath(self.trace_filename),
+                        env[LOG_FILE_VARIABLE])
+      self.assertEquals(0.5, float(env[SAMPLING_INTERVAL_VARIABLE]))
+    self.go(work)
+    self.assertEquals({}, trace_subprocess_environment({}))